@@ -1,10 +1,20 @@
 import logging
+import math
+import sys
+import sysconfig
 import time
-import collections
-import statistics
 import datetime
 import threading
-from pybit.unified_trading import WebSocket
+from dataclasses import dataclass
+import numpy as np
+import ingester
+from soa_ring import SoARing
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the kernels below then run as plain Python
+    def njit(*args, **kwargs):
+        return lambda func: func
 
 # --- ALERT AND STRATEGY THRESHOLDS (CONFIGURABLE) ---
 GREEN_ZONE_THRESHOLD = 0.55
@@ -12,25 +22,115 @@ RED_ZONE_THRESHOLD = 0.35
 CONSOLIDATION_WATCH_PERIOD = 3  # Number of candles to watch after an initial failure
 ALERT_COOLDOWN_PERIOD = 5       # Number of candles to wait before firing a new alert
 
+CANDLE_INTERVAL_MS = 60_000     # Matches the ingester's kline.1 subscription
+TRADE_RING_CAPACITY = 65536     # Sized for a peak minute of trades
+
+HA_RED = 0
+HA_GREEN = 1
+
 # Configure logging
 # Use WARNING level for alerts to make them stand out
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+
+@njit(cache=True, fastmath=True)
+def _reduce_candle(ts, vol, side, start, count, ts_lo, ts_hi, has_prev, prev_ha_open, prev_ha_close, o, h, l, c):
+    """
+    Aggregates one candle's trades and computes its Heiken Ashi values in a single compiled pass.
+
+    ts, vol and side are a SoARing's full backing arrays; the count trades from
+    physical slot start onwards are scanned in place, wrapping at the end, so
+    no slice or copy of the ring is made. Trades are time-ordered, so the scan
+    stops at the first trade after ts_hi.
+    Returns (consumed, buy_volume, sell_volume, agg_ratio, ha_open, ha_close, ha_green),
+    where consumed is the number of leading trades the ring head can advance by.
+    """
+    buy_volume = 0.0
+    sell_volume = 0.0
+    cap = ts.shape[0]
+    j = start
+    i = 0
+    while i < count and ts[j] <= ts_hi:
+        if ts[j] >= ts_lo:
+            if side[j]:
+                buy_volume += vol[j]
+            else:
+                sell_volume += vol[j]
+        i += 1
+        j += 1
+        if j == cap:
+            j = 0
+
+    total_volume = buy_volume + sell_volume
+    agg_ratio = buy_volume / total_volume if total_volume > 0 else 0.5
+
+    ha_close = (o + h + l + c) / 4.0
+    if has_prev:
+        ha_open = (prev_ha_open + prev_ha_close) / 2.0
+    else:  # First candle initialization
+        ha_open = (o + c) / 2.0
+
+    return i, buy_volume, sell_volume, agg_ratio, ha_open, ha_close, ha_close > ha_open
+
+
+@dataclass(slots=True)
+class CandleSnapshot:
+    """Per-candle metrics that are logged and fed to the setup logic."""
+    utc: str
+    close_price: float
+    ha_open: float
+    ha_close: float
+    ha_color: int  # HA_GREEN or HA_RED
+    agg_ratio: float
+    avg_bbo_imba: float
+    std_bbo_imba: float
+    def as_log_dict(self):
+        """The per-candle log line, in the same format as before the dataclass."""
+        return {
+            "utc": self.utc,
+            "close_price": self.close_price,
+            "HA_open": self.ha_open,
+            "HA_close": self.ha_close,
+            "HA_color": "Green" if self.ha_color == HA_GREEN else "Red",
+            "agg_ratio": self.agg_ratio,
+            "avg_bbo_imba": self.avg_bbo_imba,
+            "std_bbo_imba": self.std_bbo_imba,
+        }
+
+
+def make_entry_checker(red_zone, green_zone):
+    """
+    Builds the check for whether a candle meets all high-probability criteria,
+    with the thresholds bound once instead of looked up on every candle.
+    """
+    def check_entry_conditions(snapshot):
+        # 1. HA_color must be Green
+        # 2. No metrics in the Red Zone
+        # 3. At least one metric must be in the Green Zone (Conviction Check)
+        # Price agreement is not enforced: minor pullbacks are allowed if order flow is strong
+        agg_ratio = snapshot.agg_ratio
+        avg_bbo_imba = snapshot.avg_bbo_imba
+        return (snapshot.ha_color == HA_GREEN
+                and agg_ratio >= red_zone and avg_bbo_imba >= red_zone
+                and (agg_ratio >= green_zone or avg_bbo_imba >= green_zone))
+    return check_entry_conditions
+
+
 class OrderFlowTracker:
     def __init__(self, symbol):
         self.symbol = symbol
-        self.main_ws = None
-        self.depth_ws = None
+        self.book_shm = None
+        self.book = None  # Read-only view of the ingester's depth book
         
         # --- Data Buffers ---
+        # Trades are kept in a preallocated ring of parallel arrays (structure of
+        # arrays), so a candle's data is a contiguous slice with no per-trade objects.
         self.trade_data_lock = threading.Lock()
-        self.trade_buffer = collections.deque()
+        self.trades = SoARing(TRADE_RING_CAPACITY, ts='i8', vol='f8', side='u1')  # side: 1 = Buy, 0 = Sell
         self.bbo_data_lock = threading.Lock()
-        self.bbo_buffer = collections.deque() 
-        self.book_lock = threading.Lock()
-        self.live_bids = {}
-        self.live_asks = {}
-        self.is_book_ready = False
+        # BBO imbalance only needs its mean and spread, so keep Welford's running
+        # [count, mean, M2] per candle start (ms) instead of every tick.
+        self.bbo_acc = {}
         
         self.last_kline_start_time = None
         
@@ -43,32 +143,21 @@ class OrderFlowTracker:
         self.consolidation_watch_countdown = 0
         self.alert_cooldown = 0
         self.last_candle_data = None
+        self._check_entry_conditions = make_entry_checker(RED_ZONE_THRESHOLD, GREEN_ZONE_THRESHOLD)
 
+        # --- Timestamp Formatting Cache ---
+        self._fmt_day = None
+        self._fmt_day_prefix = ''
 
-    def _check_entry_conditions(self, current_data):
-        """Helper method to check if the current candle meets all high-probability criteria."""
-        
-        # 1. HA_color must be Green
-        if current_data.get('HA_color') != 'Green':
-            return False
-
-        agg_ratio = current_data.get('agg_ratio')
-        avg_bbo_imba = current_data.get('avg_bbo_imba')
-
-        # 2. No metrics in the Red Zone
-        if agg_ratio < RED_ZONE_THRESHOLD or avg_bbo_imba < RED_ZONE_THRESHOLD:
-            return False
-            
-        # 3. At least one metric must be in the Green Zone (Conviction Check)
-        if agg_ratio < GREEN_ZONE_THRESHOLD and avg_bbo_imba < GREEN_ZONE_THRESHOLD:
-            return False
-
-        # 4. Price agreement (must not make a significant lower low)
-        if self.last_candle_data and current_data.get('close_price') < self.last_candle_data.get('close_price'):
-             # This condition can be adjusted for more tolerance if needed
-             pass # For now, we allow minor pullbacks if order flow is strong
 
-        return True
+    def _format_utc(self, ts_ms):
+        """Formats a millisecond timestamp as 'YYYY-mm-dd HH:MM:SS,mmm' (UTC), calling strftime once per day."""
+        day, ms_of_day = divmod(ts_ms, 86_400_000)
+        if day != self._fmt_day:
+            self._fmt_day = day
+            self._fmt_day_prefix = datetime.datetime.fromtimestamp(day * 86_400, tz=datetime.timezone.utc).strftime('%Y-%m-%d ')
+        return (f"{self._fmt_day_prefix}{ms_of_day // 3_600_000:02d}:{ms_of_day // 60_000 % 60:02d}:"
+                f"{ms_of_day // 1000 % 60:02d},{ms_of_day % 1000:03d}")
 
 
     def _run_trade_setup_logic(self, current_data):
@@ -79,7 +168,7 @@ class OrderFlowTracker:
             self.alert_cooldown -= 1
 
         # --- Update Heiken Ashi Streak ---
-        if current_data.get('HA_color') == 'Green':
+        if current_data.ha_color == HA_GREEN:
             self.ha_green_streak += 1
         else:
             # If the trend breaks, reset everything
@@ -93,7 +182,7 @@ class OrderFlowTracker:
         # --- "Strict 3+1" Protocol Check ---
         if self.ha_green_streak == 4:
             if self._check_entry_conditions(current_data):
-                logging.warning(f"*** TRADE SETUP: Strict '3+1' Entry Triggered at {current_data['utc']} ***")
+                logging.warning(f"*** TRADE SETUP: Strict '3+1' Entry Triggered at {current_data.utc} ***")
                 self.alert_cooldown = ALERT_COOLDOWN_PERIOD
                 self.consolidation_watch_countdown = 0 # Turn off consolidation watch
                 return
@@ -105,7 +194,7 @@ class OrderFlowTracker:
         # --- "Consolidation Watch" Protocol Check ---
         elif self.consolidation_watch_countdown > 0:
             if self._check_entry_conditions(current_data):
-                logging.warning(f"*** TRADE SETUP: 'Consolidation Watch' Entry Triggered at {current_data['utc']} ***")
+                logging.warning(f"*** TRADE SETUP: 'Consolidation Watch' Entry Triggered at {current_data.utc} ***")
                 self.alert_cooldown = ALERT_COOLDOWN_PERIOD
                 self.consolidation_watch_countdown = 0 # Reset after firing
                 return
@@ -120,54 +209,48 @@ class OrderFlowTracker:
         candle_start_ms = int(candle['start'])
         candle_end_ms = int(candle['end'])
         
-        # --- Heiken Ashi Full Calculation ---
         open_price = float(candle['open'])
         high_price = float(candle['high'])
         low_price = float(candle['low'])
         close_price = float(candle['close'])
 
-        ha_close = (open_price + high_price + low_price + close_price) / 4.0
+        formatted_timestamp = self._format_utc(candle_start_ms)
 
-        if self.last_ha_open is None: # First candle initialization
-            ha_open = (open_price + close_price) / 2.0
-        else:
-            ha_open = (self.last_ha_open + self.last_ha_close) / 2.0
-        
-        ha_color = "Green" if ha_close > ha_open else "Red"
+        # --- Drain buffers, aggregate trades and compute Heiken Ashi ---
+        # One pass over the ring in place; everything up to the candle end is consumed.
+        trades = self.trades
+        with self.trade_data_lock:
+            consumed, buy_volume, sell_volume, agg_ratio, ha_open, ha_close, ha_green = _reduce_candle(
+                trades.columns['ts'], trades.columns['vol'], trades.columns['side'], trades.head % trades.cap, len(trades),
+                candle_start_ms, candle_end_ms,
+                self.last_ha_open is not None, self.last_ha_open or 0.0, self.last_ha_close or 0.0,
+                open_price, high_price, low_price, close_price)
+            trades.consume(consumed)
+        with self.bbo_data_lock:
+            bbo_count, bbo_mean, bbo_m2 = self.bbo_acc.pop(candle_start_ms, (0, 0.5, 0.0))
+            for stale in [k for k in self.bbo_acc if k < candle_start_ms]: del self.bbo_acc[stale]
+
+        avg_bbo_imba = bbo_mean
+        std_bbo_imba = math.sqrt(bbo_m2 / bbo_count) if bbo_count > 1 else 0.0
+        ha_color = HA_GREEN if ha_green else HA_RED
 
         # Update state for the next candle's calculation
         self.last_ha_open = ha_open
         self.last_ha_close = ha_close
-        
-        dt_object = datetime.datetime.utcfromtimestamp(candle_start_ms / 1000.0)
-        formatted_timestamp = dt_object.strftime('%Y-%m-%d %H:%M:%S,') + f"{dt_object.microsecond // 1000:03d}"
-
-        # --- Drain buffers and process data (condensed for brevity) ---
-        with self.trade_data_lock:
-            relevant_trades = [t for t in self.trade_buffer if candle_start_ms <= int(t['T']) <= candle_end_ms]
-            self.trade_buffer = collections.deque(t for t in self.trade_buffer if int(t['T']) > candle_end_ms)
-        with self.bbo_data_lock:
-            relevant_bbo_updates = [b for b in self.bbo_buffer if candle_start_ms <= b['ts'] <= candle_end_ms]
-            self.bbo_buffer = collections.deque(b for b in self.bbo_buffer if b['ts'] > candle_end_ms)
-
-        buy_volume = sum(float(t['v']) for t in relevant_trades if t['S'] == 'Buy')
-        sell_volume = sum(float(t['v']) for t in relevant_trades if t['S'] == 'Sell')
-        total_volume = buy_volume + sell_volume
-        agg_ratio = (buy_volume / total_volume) if total_volume > 0 else 0.5
-        avg_bbo_imba = statistics.mean([b['imbalance'] for b in relevant_bbo_updates]) if relevant_bbo_updates else 0.5
 
         # --- Log Combined Output ---
-        output_data = {
-            "utc": formatted_timestamp,
-            "close_price": close_price,
-            "HA_open": round(ha_open, 5),
-            "HA_close": round(ha_close, 5),
-            "HA_color": ha_color,
-            "agg_ratio": round(agg_ratio, 4),
-            "avg_bbo_imba": round(avg_bbo_imba, 4),
-            # Other metrics can be added here if needed for logging
-        }
-        logging.info(output_data)
+        output_data = CandleSnapshot(
+            utc=formatted_timestamp,
+            close_price=close_price,
+            ha_open=round(ha_open, 5),
+            ha_close=round(ha_close, 5),
+            ha_color=ha_color,
+            agg_ratio=round(agg_ratio, 4),
+            avg_bbo_imba=round(avg_bbo_imba, 4),
+            std_bbo_imba=round(std_bbo_imba, 4),
+            # Other metrics can be added to CandleSnapshot if needed for logging
+        )
+        logging.info(output_data.as_log_dict())
 
         # --- NEW: Run the setup detection logic ---
         self._run_trade_setup_logic(output_data)
@@ -175,78 +258,82 @@ class OrderFlowTracker:
         # Store data for the next candle's comparison
         self.last_candle_data = output_data
 
-    # --- The rest of the class methods (connect, run, handle_*, etc.) remain the same ---
-    # ... (omitting for brevity, but they are identical to the previous script) ...
     def connect(self):
-        depth_thread = threading.Thread(target=self._connect_depth_book, daemon=True)
-        depth_thread.start()
-        logging.info("Connecting Main WebSocket (Kline, Trade, BBO)...")
-        while True:
-            try:
-                self.main_ws = WebSocket(testnet=False, channel_type="linear")
-                self.main_ws.kline_stream(interval=1, symbol=self.symbol, callback=self.handle_kline_message)
-                self.main_ws.trade_stream(symbol=self.symbol, callback=self.handle_trade_message)
-                self.main_ws.orderbook_stream(depth=1, symbol=self.symbol, callback=self.handle_bbo_message)
-                logging.info(f"Main WS Subscribed to kline.1, publicTrade, and orderbook.1 for {self.symbol}")
-                break
-            except Exception as e:
-                logging.error(f"Failed to connect to Main WebSocket: {e}. Retrying in 30 seconds...")
-                time.sleep(30)
-
-    def _connect_depth_book(self):
-        logging.info("Connecting Depth WebSocket (Orderbook.50)...")
-        while True:
-            try:
-                self.depth_ws = WebSocket(testnet=False, channel_type="linear")
-                self.depth_ws.orderbook_stream(depth=50, symbol=self.symbol, callback=self.handle_depth_book_message)
-                logging.info(f"Depth WS Subscribed to orderbook.50 for {self.symbol}")
-                while True: time.sleep(60)
-            except Exception as e:
-                logging.error(f"Failed to connect to Depth WebSocket: {e}. Retrying in 30 seconds...")
-                time.sleep(30)
+        # Compile the candle kernel now so the first candle is not delayed by the JIT
+        _reduce_candle(np.zeros(1, dtype=np.int64), np.zeros(1), np.zeros(1, dtype=np.uint8),
+                       0, 0, 0, 0, False, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+        # Market data comes from ingester.py through shared memory; this process
+        # opens no WebSocket of its own.
+        logging.info(f"Attaching to ingester streams for {self.symbol}...")
+        # Klines last: a confirm is only handled after every trade and BBO
+        # update the ingester received before it (see ingester.poll_rings)
+        rings = [
+            (ingester.ShmRing.attach(self.symbol, "trades"), self.handle_trade_records),
+            (ingester.ShmRing.attach(self.symbol, "bbo"), self.handle_bbo_records),
+            (ingester.ShmRing.attach(self.symbol, "kline"), self.handle_kline_records),
+        ]
+        self.book_shm, self.book = ingester.attach_book(self.symbol)
+        threading.Thread(target=ingester.poll_rings, args=(rings,),
+                         kwargs={"on_replaced": self._on_ingester_restart}, daemon=True).start()
+        logging.info(f"Attached to kline.1, publicTrade, orderbook.1 and orderbook.{ingester.DEPTH_BOOK_LEVELS} for {self.symbol}")
+
+    def _on_ingester_restart(self, ring):
+        # Called from the polling thread once per re-attached ring; the depth
+        # book segment was replaced by the same restart
+        if ingester.book_generation(self.book) != ring.generation:
+            self.book_shm, self.book = ingester.attach_book(self.symbol)
 
     def run(self):
+        # Record ingestion and candle processing only share the small per-buffer
+        # locks above, so on a free-threaded build (python3.13t) they can run in
+        # parallel. NumPy 2.1+ supports free threading, but numba does not:
+        # importing it re-enables the GIL unless PYTHON_GIL=0 forces it off.
+        # Standard builds always keep the GIL (and refuse PYTHON_GIL=0), so the
+        # hint is only shown on free-threaded builds.
+        if sysconfig.get_config_var("Py_GIL_DISABLED") and sys._is_gil_enabled():
+            logging.info("GIL was re-enabled by an imported extension such as numba; run with PYTHON_GIL=0 to keep callbacks in parallel.")
         self.connect()
         while True: time.sleep(60)
 
-    def handle_trade_message(self, message):
+    def handle_trade_records(self, records):
+        # Columns follow ingester.TRADE_FIELDS; the ingester already parsed
+        # the strings once, so the block is copied straight into the ring
         with self.trade_data_lock:
-            for trade in message.get("data", []): self.trade_buffer.append(trade)
-
-    def handle_bbo_message(self, message):
-        try:
-            data = message.get("data", {})
-            bids, asks = data.get("b", []), data.get("a", [])
-            if not bids or not asks: return
-            bid_size, ask_size = float(bids[0][1]), float(asks[0][1])
-            total_size = bid_size + ask_size
-            imbalance = bid_size / total_size if total_size > 0 else 0.5
-            with self.bbo_data_lock: self.bbo_buffer.append({"ts": int(message.get("ts")), "imbalance": imbalance})
-        except Exception as e: logging.error(f"Error processing BBO message: {e} - Data: {message}")
-
-    def handle_depth_book_message(self, message):
-        message_type, data = message.get("type"), message.get("data", {})
-        try:
-            with self.book_lock:
-                if message_type == "snapshot":
-                    self.live_bids = {b[0]: float(b[1]) for b in data.get("b", [])}
-                    self.live_asks = {a[0]: float(a[1]) for a in data.get("a", [])}
-                    self.is_book_ready = True
-                elif message_type == "delta":
-                    for b in data.get("b", []):
-                        if float(b[1]) == 0: self.live_bids.pop(b[0], None)
-                        else: self.live_bids[b[0]] = float(b[1])
-                    for a in data.get("a", []):
-                        if float(a[1]) == 0: self.live_asks.pop(a[0], None)
-                        else: self.live_asks[a[0]] = float(a[1])
-        except Exception as e: logging.error(f"Error processing Depth 50 message: {e} - Data: {message}")
-
-    def handle_kline_message(self, message):
-        candle = message.get("data", [])[0]
-        if candle.get("confirm") and self.last_kline_start_time != candle['start']:
-            self.last_kline_start_time = candle['start']
-            self.process_candle_data(candle)
+            self.trades.extend(ts=records[:, 0], vol=records[:, 2], side=records[:, 3])
 
+    def handle_bbo_records(self, records):
+        # Columns follow ingester.BBO_FIELDS
+        bid_size, ask_size = records[:, 3], records[:, 5]
+        total_size = bid_size + ask_size
+        imbalance = np.divide(bid_size, total_size, out=np.full(len(records), 0.5), where=total_size > 0)
+        with self.bbo_data_lock:
+            for ts, imb in zip(records[:, 0].astype(np.int64).tolist(), imbalance.tolist()):
+                candle_start_ms = ts - ts % CANDLE_INTERVAL_MS
+                acc = self.bbo_acc.get(candle_start_ms)
+                if acc is None: self.bbo_acc[candle_start_ms] = [1, imb, 0.0]
+                else:
+                    n = acc[0] + 1
+                    delta = imb - acc[1]
+                    acc[1] += delta / n
+                    acc[2] += delta * (imb - acc[1])
+                    acc[0] = n
+
+    def handle_kline_records(self, records):
+        # Columns follow ingester.KLINE_FIELDS; only confirmed candles are processed
+        for start, end, o, h, l, c, volume, confirm in records.tolist():
+            if confirm and self.last_kline_start_time != start:
+                self.last_kline_start_time = start
+                self.process_candle_data({'start': int(start), 'end': int(end), 'open': o, 'high': h,
+                                          'low': l, 'close': c, 'volume': volume})
+
+    @property
+    def is_book_ready(self):
+        return self.book is not None and self.book[0, 0] > 0
+
+    def get_depth_book(self):
+        """Returns a consistent copy of the depth book as (bid_px, bid_sz, ask_px, ask_sz), best level first."""
+        return ingester.read_book(self.book)
 
 if __name__ == "__main__":
     tracker = OrderFlowTracker(symbol="POPCATUSDT")
@@ -1,165 +1,269 @@
 import sys
 import threading
 import queue
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-import mplfinance as mpf
-from pybit.unified_trading import WebSocket
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtCore
+from scipy.signal import lfilter
 from time import sleep
+import ingester
 
 # --- Global Variables ---
-SYMBOL = "POPCATUSDT"
-INTERVAL = 1
+SYMBOL = "POPCATUSDT"  # 1-minute candles come from the ingester's kline.1 stream
 MAX_CANDLES_DISPLAY = 60  # Number of candles to display on the chart
-data_queue = queue.Queue() # Thread-safe queue for websocket data
+REFRESH_INTERVAL_MS = 100  # Chart refresh period; frames without new data are skipped
+MAX_HISTORY_CANDLES = 2 * MAX_CANDLES_DISPLAY  # Raw candles kept; only the displayed ones plus the HA seed are needed
+data_queue = queue.Queue() # Thread-safe queue for ingester data
 
 # This DataFrame will store all our raw candle data
 # We need to keep a history for accurate Heikin Ashi calculation
 historical_df = pd.DataFrame(columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
 historical_df = historical_df.set_index('timestamp')
 
-# --- 1. WebSocket Data Handling ---
+# Heikin Ashi results are cached between frames. Rows up to and including
+# last_confirmed_ts belong to closed candles and are never recomputed.
+ha_cache_df = None
+last_confirmed_ts = None
 
-def handle_websocket_message(message):
+# --- 1. Ingester Data Handling ---
+
+def handle_kline_records(records):
     """
-    Callback function to handle incoming kline data from the websocket.
-    It puts the received candle data into a thread-safe queue.
+    Callback function to handle new kline records from the ingester.
+    It puts each candle into a thread-safe queue, shaped like Bybit's kline data.
     """
-    # Extract the candle data from the message
-    # The structure is {"topic": "...", "data": [ {...} ], ...}
-    candle = message.get("data", [{}])[0]
-    
-    # Ensure the candle has data before processing
-    if "start" in candle:
-        data_queue.put(candle)
+    # Columns follow ingester.KLINE_FIELDS
+    for start, _, o, h, l, c, volume, confirm in records.tolist():
+        data_queue.put({'start': int(start), 'open': o, 'high': h, 'low': l, 'close': c,
+                        'volume': volume, 'confirm': bool(confirm)})
 
-def start_websocket_thread():
+def start_ingester_thread():
     """
-    Initializes and starts the Bybit WebSocket connection in a separate thread.
+    Attaches to the ingester's kline stream and polls it in a separate thread.
     """
-    print(f"Attempting to connect to WebSocket for {SYMBOL}...")
-    try:
-        ws = WebSocket(
-            testnet=False,
-            channel_type="linear",
-        )
-        ws.kline_stream(
-            interval=INTERVAL,
-            symbol=SYMBOL,
-            callback=handle_websocket_message
-        )
-        print(f"Successfully subscribed to {SYMBOL} kline stream.")
-    except Exception as e:
-        print(f"Error connecting to WebSocket: {e}")
-        sys.exit(1)
-        
-    # Keep the thread alive (the pybit WebSocket runs in its own daemon threads)
-    while True:
-        sleep(1)
+    print(f"Attaching to ingester kline stream for {SYMBOL}...")
+    # Replay what is still in the ring so the chart starts with some history
+    ring = ingester.ShmRing.attach(SYMBOL, "kline", replay=True)
+    print(f"Successfully attached to {SYMBOL} kline stream.")
+    ingester.poll_rings([(ring, handle_kline_records)])
 
 # --- 2. Heikin Ashi Calculation ---
 
-def calculate_heikin_ashi(df_in):
+def calculate_heikin_ashi(df_in, prev_ha_open=None, prev_ha_close=None):
     """
     Calculates Heikin Ashi candles from a standard OHLC DataFrame.
     
-    This calculation *depends on the previous candle*, which is why we must
-    calculate it on the full historical DataFrame, not just the segment
-    we are about to plot.
+    This calculation *depends on the previous candle*. Either pass the full
+    history, or pass only the new rows together with the HA open/close of
+    the candle right before them (prev_ha_open / prev_ha_close).
     """
     if df_in.empty:
         return df_in
 
-    ha_df = pd.DataFrame(index=df_in.index)
+    o = df_in['open'].to_numpy(dtype=float)
+    h = df_in['high'].to_numpy(dtype=float)
+    l = df_in['low'].to_numpy(dtype=float)
+    c = df_in['close'].to_numpy(dtype=float)
 
     # HA Close: (Open + High + Low + Close) / 4
-    ha_df['close'] = (df_in['open'] + df_in['high'] + df_in['low'] + df_in['close']) / 4
+    ha_close = (o + h + l + c) / 4
 
     # HA Open: (Previous HA Open + Previous HA Close) / 2
-    # For the first candle, HA Open = (Open + Close) / 2
-    ha_df['open'] = 0.0
-    if not ha_df.empty:
-        ha_df.iloc[0, ha_df.columns.get_loc('open')] = (df_in.iloc[0]['open'] + df_in.iloc[0]['close']) / 2
-    
-    for i in range(1, len(ha_df)):
-        ha_df.iloc[i, ha_df.columns.get_loc('open')] = \
-            (ha_df.iloc[i-1]['open'] + ha_df.iloc[i-1]['close']) / 2
+    # For the first candle, HA Open = (Open + Close) / 2 unless we are seeded
+    # The recurrence is a first-order IIR filter, so lfilter evaluates it in
+    # a single C-level pass instead of one pandas call per row.
+    ha_open = np.empty_like(ha_close)
+    if prev_ha_open is None:
+        ha_open[0] = (o[0] + c[0]) / 2
+    else:
+        ha_open[0] = (prev_ha_open + prev_ha_close) / 2
+    if len(ha_close) > 1:
+        ha_open[1:] = lfilter([0.5], [1.0, -0.5], ha_close[:-1], zi=[ha_open[0] * 0.5])[0]
 
-    # HA High: Max(High, HA Open, HA Close)
-    ha_df['high'] = ha_df[['open', 'close']].join(df_in['high']).max(axis=1)
+    return pd.DataFrame({
+        'open': ha_open,
+        # HA High: Max(High, HA Open, HA Close)
+        'high': np.maximum.reduce([h, ha_open, ha_close]),
+        # HA Low: Min(Low, HA Open, HA Close)
+        'low': np.minimum.reduce([l, ha_open, ha_close]),
+        'close': ha_close,
+        # Volume is not averaged
+        'volume': df_in['volume'].to_numpy(),
+    }, index=df_in.index)
 
-    # HA Low: Min(Low, HA Open, HA Close)
-    ha_df['low'] = ha_df[['open', 'close']].join(df_in['low']).min(axis=1)
-    
-    # Volume is not averaged
-    ha_df['volume'] = df_in['volume']
+# --- 3. Plotting & Animation ---
 
-    return ha_df
+# Charts are drawn with pyqtgraph (Qt, optionally OpenGL) instead of matplotlib:
+# bar items are updated in place, so a refresh costs well under a millisecond.
+CANDLE_SECONDS = 60
+CANDLE_WIDTH = 0.6 * CANDLE_SECONDS  # Body width in seconds of the time axis
+WICK_WIDTH = 0.08 * CANDLE_SECONDS
+UP_COLOR = 'g'
+DOWN_COLOR = 'r'
 
-# --- 3. Plotting & Animation ---
 
-# Set up the plot
-fig, (ax1, ax2) = plt.subplots(2, 1, sharex=True, figsize=(12, 8))
-fig.suptitle(f'{SYMBOL} 1-Minute Live Chart', fontsize=16)
+class CandlePanel:
+    """
+    A price plot with candle bodies and wicks, plus a volume plot below it.
+
+    All items persist for the life of the window; update() only replaces their data.
+    """
 
-# Create a custom style for mplfinance
-mpf_style = mpf.make_mpf_style(base_mpf_style='charles',
-                               marketcolors=mpf.make_marketcolors(up='g', down='r', inherit=True),
-                               gridstyle=':',
-                               y_on_right=True)
+    def __init__(self, layout, row, title):
+        self.price = layout.addPlot(row=row, col=0, title=title,
+                                    axisItems={'bottom': pg.DateAxisItem(utcOffset=0)})
+        self.volume_plot = layout.addPlot(row=row + 1, col=0,
+                                          axisItems={'bottom': pg.DateAxisItem(utcOffset=0)})
+        layout.ci.layout.setRowStretchFactor(row, 3)
+        layout.ci.layout.setRowStretchFactor(row + 1, 1)
 
-# Set titles for the subplots
-ax1.set_title("Standard Candles")
-ax1.set_ylabel("Price (USDT)")
-ax2.set_title("Heikin Ashi")
-ax2.set_ylabel("Price (USDT)")
-plt.xlabel("Time")
+        self.price.setLabel('right', "Price (USDT)")
+        self.price.showAxis('right')
+        self.price.hideAxis('left')
+        self.price.showGrid(x=True, y=True, alpha=0.3)
+        self.price.hideAxis('bottom')
+        self.volume_plot.setXLink(self.price)
+        self.volume_plot.showAxis('right')
+        self.volume_plot.hideAxis('left')
+
+        # Only the visible candles decide the y range
+        for plot in (self.price, self.volume_plot):
+            plot.setMouseEnabled(x=False, y=False)
+            plot.enableAutoRange(axis='y')
+            plot.setAutoVisible(y=True)
+
+        # (down, up) brush and pen, indexed by whether the candle closed up
+        self.brushes = (pg.mkBrush(DOWN_COLOR), pg.mkBrush(UP_COLOR))
+        self.pens = (pg.mkPen(DOWN_COLOR), pg.mkPen(UP_COLOR))
+
+        empty = np.zeros(0)
+        self.wicks = pg.BarGraphItem(x=empty, y0=empty, height=empty, width=WICK_WIDTH)
+        self.bodies = pg.BarGraphItem(x=empty, y0=empty, height=empty, width=CANDLE_WIDTH)
+        self.volume = pg.BarGraphItem(x=empty, height=empty, width=CANDLE_WIDTH)
+        self.price.addItem(self.wicks)
+        self.price.addItem(self.bodies)
+        self.volume_plot.addItem(self.volume)
+
+    def update(self, df):
+        """Replaces the bar data with the candles in df, which has a DatetimeIndex."""
+        x = df.index.values.astype('datetime64[ms]').astype(np.int64) / 1e3  # UNIX seconds
+        o = df['open'].to_numpy(dtype=float)
+        h = df['high'].to_numpy(dtype=float)
+        l = df['low'].to_numpy(dtype=float)
+        c = df['close'].to_numpy(dtype=float)
+        up = (c >= o).tolist()
+        colors = [self.brushes[u] for u in up]
+        pens = [self.pens[u] for u in up]
+
+        self.bodies.setOpts(x=x, y0=np.minimum(o, c), height=np.abs(c - o), brushes=colors, pens=pens)
+        self.wicks.setOpts(x=x, y0=l, height=h - l, brushes=colors, pens=pens)
+        self.volume.setOpts(x=x, height=df['volume'].to_numpy(dtype=float), brushes=colors, pens=pens)
+        self.price.setXRange(x[-1] - (MAX_CANDLES_DISPLAY - 0.5) * CANDLE_SECONDS,
+                             x[-1] + CANDLE_SECONDS, padding=0)
+
+
+def create_window():
+    """Builds the chart window; must be called after the Qt application exists."""
+    win = pg.GraphicsLayoutWidget(title=f'{SYMBOL} 1-Minute Live Chart')
+    win.resize(1200, 800)
+    win.addLabel(f'{SYMBOL} 1-Minute Live Chart', row=0, col=0, size='16pt')
+    candle_panel = CandlePanel(win, 1, "Standard Candles")
+    ha_panel = CandlePanel(win, 3, "Heikin Ashi")
+    ha_panel.price.setXLink(candle_panel.price)
+    ha_panel.volume_plot.setLabel('bottom', "Time (UTC)")
+    return win, candle_panel, ha_panel
 
 
 def process_queue_data():
     """
     Processes all new data from the queue and updates the global historical_df.
     This handles both new candles and updates to the current (unconfirmed) candle.
+
+    Returns the timestamp of the newest confirmed candle seen, or None.
     """
     global historical_df
-    
+
+    newest_confirmed_ts = None
+    rows = []
+
     while not data_queue.empty():
         try:
             candle = data_queue.get_nowait()
             
             # Convert data to correct types
-            timestamp = pd.to_datetime(int(candle['start']), unit='ms')
-            new_data = {
-                'open': float(candle['open']),
-                'high': float(candle['high']),
-                'low': float(candle['low']),
-                'close': float(candle['close']),
-                'volume': float(candle['volume']),
-            }
-
-            # Update existing candle or append new one
+            rows.append((
+                int(candle['start']),
+                float(candle['open']),
+                float(candle['high']),
+                float(candle['low']),
+                float(candle['close']),
+                float(candle['volume']),
+            ))
+
             # 'confirm: false' means the candle is still active
             # 'confirm: true' means the candle is closed
-            historical_df.loc[timestamp] = new_data
+            if candle.get('confirm'):
+                newest_confirmed_ts = pd.to_datetime(int(candle['start']), unit='ms')
             
         except queue.Empty:
             break
         except Exception as e:
             print(f"Error processing queue data: {e}")
-            
-    # Sort by timestamp just in case and remove duplicates
-    if not historical_df.empty:
-        historical_df = historical_df.sort_index().drop_duplicates(keep='last')
 
-def animate(i):
+    if not rows:
+        return newest_confirmed_ts
+
+    # Append the whole batch at once; a later update of the same candle
+    # replaces the earlier one
+    new_df = pd.DataFrame(rows, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+    new_df['timestamp'] = pd.to_datetime(new_df['timestamp'], unit='ms')
+    new_df = new_df.set_index('timestamp')
+    combined = pd.concat([historical_df, new_df]) if not historical_df.empty else new_df
+    combined = combined[~combined.index.duplicated(keep='last')].sort_index()
+
+    # Only the tail is ever plotted or used to seed Heikin Ashi
+    historical_df = combined.iloc[-MAX_HISTORY_CANDLES:]
+
+    return newest_confirmed_ts
+
+def update_heikin_ashi_cache(newest_confirmed_ts):
+    """
+    Brings ha_cache_df up to date with historical_df.
+
+    Only candles after last_confirmed_ts (the live candle plus any newly
+    confirmed ones) are recalculated, seeded from the cached HA values of the
+    last confirmed candle, so the per-frame cost does not grow with history.
+    """
+    global ha_cache_df, last_confirmed_ts
+
+    if last_confirmed_ts is None or ha_cache_df is None:
+        ha_cache_df = calculate_heikin_ashi(historical_df)
+    else:
+        # Only the seed row and what is on screen need to be kept around
+        frozen = ha_cache_df.loc[:last_confirmed_ts].iloc[-MAX_CANDLES_DISPLAY:]
+        tail = historical_df.loc[historical_df.index > last_confirmed_ts]
+        if not tail.empty:
+            seed = frozen.iloc[-1]
+            tail = calculate_heikin_ashi(tail, seed['open'], seed['close'])
+            frozen = pd.concat([frozen, tail])
+        ha_cache_df = frozen
+
+    if newest_confirmed_ts is not None:
+        last_confirmed_ts = newest_confirmed_ts
+
+def refresh(candle_panel, ha_panel):
     """
-    The main animation function, called repeatedly by FuncAnimation.
+    The main refresh function, called repeatedly by a Qt timer.
     """
     global historical_df
+
+    # Nothing new from the ingester, so the chart is already current
+    if data_queue.empty():
+        return
     
-    # 1. Process all new data from the websocket
-    process_queue_data()
+    # 1. Process all new data from the ingester
+    newest_confirmed_ts = process_queue_data()
     
     # Don't plot if we have no data
     if historical_df.empty or len(historical_df) < 2:
@@ -169,52 +273,40 @@ def animate(i):
     # 2. Get the *last* MAX_CANDLES_DISPLAY for standard plotting
     plot_df = historical_df.iloc[-MAX_CANDLES_DISPLAY:]
 
-    # 3. Calculate Heikin Ashi on the *entire* history
-    #    This is crucial for the dependency to be correct
-    ha_full_df = calculate_heikin_ashi(historical_df)
+    # 3. Update Heikin Ashi for the candles that changed since the last frame
+    #    The cache carries the previous-candle dependency forward
+    update_heikin_ashi_cache(newest_confirmed_ts)
     
     # 4. Get the *last* MAX_CANDLES_DISPLAY of the HA data for plotting
-    plot_ha_df = ha_full_df.iloc[-MAX_CANDLES_DISPLAY:]
+    plot_ha_df = ha_cache_df.iloc[-MAX_CANDLES_DISPLAY:]
 
-    # 5. Clear and redraw the plots
-    ax1.clear()
-    ax2.clear()
-    
-    # Re-apply formatting as clear() removes it
-    ax1.set_title("Standard Candles")
-    ax1.set_ylabel("Price (USDT)")
-    ax2.set_title("Heikin Ashi")
-    ax2.set_ylabel("Price (USDT)")
-
-    # Plot using mplfinance
-    mpf.plot(plot_df, ax=ax1, type='candle', style=mpf_style, volume=ax1.twinx())
-    mpf.plot(plot_ha_df, ax=ax2, type='candle', style=mpf_style, volume=ax2.twinx())
-    
-    # Improve x-axis labels
-    for label in ax2.get_xticklabels():
-        label.set_rotation(30)
-        label.set_ha('right')
-        
-    plt.tight_layout(rect=[0, 0.03, 1, 0.95]) # Adjust layout
+    # 5. Update the persistent bar items in place
+    candle_panel.update(plot_df)
+    ha_panel.update(plot_ha_df)
 
 # --- 4. Main Execution ---
 
 if __name__ == "__main__":
-    # Start the websocket connection in a background thread
+    # Follow the ingester's kline stream in a background thread
     # 'daemon=True' ensures the thread will close when the main program exits
-    ws_thread = threading.Thread(target=start_websocket_thread, daemon=True)
-    ws_thread.start()
+    ingester_thread = threading.Thread(target=start_ingester_thread, daemon=True)
+    ingester_thread.start()
     
-    # Give the websocket a second to connect
-    print("Waiting for WebSocket connection (2s)...")
+    # Give the first candles a moment to arrive
+    print("Waiting for ingester data (2s)...")
     sleep(2)
 
-    # Start the animation
-    print("Starting animation...")
-    ani = animation.FuncAnimation(fig, animate, interval=1000) # Update every 1000ms (1 second)
+    # Start the chart
+    print("Starting chart...")
+    app = pg.mkQApp(f'{SYMBOL} Heikin Ashi')
+    win, candle_panel, ha_panel = create_window()
+    timer = QtCore.QTimer()
+    timer.timeout.connect(lambda: refresh(candle_panel, ha_panel))
+    timer.start(REFRESH_INTERVAL_MS)
+    win.show()
     
     try:
-        plt.show()
+        pg.exec()
     except KeyboardInterrupt:
-        print("Animation stopped.")
+        print("Chart stopped.")
         sys.exit(0)
@@ -0,0 +1,418 @@
+import logging
+import os
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from pybit_fast import RawDeltaWebSocket, use_fast_json
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the kernels below then run as plain Python
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+# Shared market-data ingester.
+#
+# Runs ONE WebSocket for a symbol and publishes everything the analytics
+# scripts need into named shared-memory segments:
+#   - kline.1, publicTrade and orderbook.1 go into broadcast ring buffers
+#   - orderbook.50 is maintained as a sorted depth book
+# OrderF_HAFlags.py, heinki_ashi.py and order_1minStats.py attach to these
+# segments read-only instead of opening their own connections.
+#
+# Usage: python ingester.py [SYMBOL]   (start it before the analytics scripts)
+
+# --- Configuration ---
+SYMBOL = "POPCATUSDT"
+DEPTH_BOOK_LEVELS = 50  # Matches the orderbook.50 subscription
+BOOK_CAPACITY = 128     # Price levels kept per side of the depth book
+
+# Record layouts (all float64) and ring capacities for each broadcast stream
+KLINE_FIELDS = ("start", "end", "open", "high", "low", "close", "volume", "confirm")
+TRADE_FIELDS = ("ts", "price", "volume", "is_buy")
+BBO_FIELDS = ("ts", "time", "bid_price", "bid_size", "ask_price", "ask_size")  # time = local UNIX receipt time
+STREAMS = {
+    "kline": (KLINE_FIELDS, 1024),
+    "trades": (TRADE_FIELDS, 65536),
+    "bbo": (BBO_FIELDS, 65536),
+}
+
+# Depth book layout: row 0 is the header [seq, n_bids, n_asks, owner_pid,
+# generation, ...], rows 1-4 hold bid prices, bid sizes, ask prices and ask
+# sizes, best level first. seq is odd while the writer is mid-update (a seqlock).
+BOOK_SHAPE = (5, BOOK_CAPACITY)
+
+# int64 [write_count, capacity, owner_pid, generation]. owner_pid is the
+# ingester that created the segment; generation is unique per ingester run,
+# so readers can tell a restarted ingester's segments from the ones they hold.
+RING_HEADER_WORDS = 4
+RING_HEADER_BYTES = RING_HEADER_WORDS * 8
+RING_STALE_SECONDS = 10.0  # A ring this long without new records is checked for a restart
+
+def segment_name(symbol, stream):
+    return f"bybit_{symbol}_{stream}"
+
+def _attach_segment(name):
+    """Attaches to an existing segment without letting this process's resource tracker unlink it on exit."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == "posix":  # Only POSIX segments are registered with the tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+def _wait_for_segment(name):
+    while True:
+        try:
+            return _attach_segment(name)
+        except FileNotFoundError:
+            logging.warning(f"Waiting for ingester segment '{name}' (is ingester.py running?)...")
+            time.sleep(5)
+
+def _pid_alive(pid):
+    if pid <= 0:
+        return False
+    if os.name == "nt":  # os.kill would terminate the process; assume it is alive
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # Alive, but owned by another user
+        return True
+    return True
+
+def _create_segment(name, size, read_owner_pid):
+    """
+    Creates a named segment. A segment of the same name left behind by an
+    ingester that is no longer running is replaced; one whose owner is still
+    alive is never touched.
+
+    On Windows a named segment lives exactly as long as some process has it
+    open, so an existing one cannot be replaced: stop the analytics scripts
+    (the readers) as well before restarting the ingester.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        if os.name == "nt":
+            raise RuntimeError(f"Segment '{name}' is still open in another process (an ingester or an "
+                               f"analytics script); on Windows, stop them all before restarting the ingester.")
+    stale = _attach_segment(name)
+    try:
+        owner_pid = read_owner_pid(stale.buf)
+    except (TypeError, ValueError):  # Too small for the header: an older layout
+        owner_pid = 0
+    stale.close()
+    if owner_pid != os.getpid() and _pid_alive(owner_pid):
+        raise RuntimeError(f"Segment '{name}' belongs to a running ingester (pid {owner_pid}); stop it first.")
+    logging.warning(f"Replacing segment '{name}' left behind by ingester pid {owner_pid}.")
+    stale.unlink()
+    return shared_memory.SharedMemory(name=name, create=True, size=size)
+
+def _ring_header(buf):
+    return np.ndarray((RING_HEADER_WORDS,), dtype=np.int64, buffer=buf)
+
+
+# --- Shared Memory Ring Buffer ---
+
+class ShmRing:
+    """
+    Broadcast ring of fixed-width float64 records in named shared memory.
+
+    Single writer (the ingester) and any number of readers in other processes.
+    Each reader keeps its own cursor, so readers never block the writer; a
+    reader that falls more than a full ring behind skips the lost records.
+    """
+    def __init__(self, shm, width, create=False, capacity=0, generation=0):
+        self.shm = shm
+        self.header = _ring_header(shm.buf)
+        if create:
+            self.header[:] = (0, capacity, os.getpid(), generation)
+        self.cap = int(self.header[1])
+        self.owner_pid = int(self.header[2])
+        self.generation = int(self.header[3])
+        self.records = np.ndarray((self.cap, width), dtype=np.float64, buffer=shm.buf, offset=RING_HEADER_BYTES)
+        self.cursor = int(self.header[0])
+        self.last_advance = time.monotonic()  # Reader only: when new records were last seen
+        self.owner_exit_logged = False
+
+    @classmethod
+    def create(cls, symbol, stream, generation):
+        fields, capacity = STREAMS[stream]
+        size = RING_HEADER_BYTES + capacity * len(fields) * 8
+        shm = _create_segment(segment_name(symbol, stream), size, lambda buf: int(_ring_header(buf)[2]))
+        return cls(shm, len(fields), create=True, capacity=capacity, generation=generation)
+
+    @classmethod
+    def attach(cls, symbol, stream, replay=False):
+        """Attaches a reader. With replay=True it starts from the oldest record still in the ring."""
+        fields, _ = STREAMS[stream]
+        ring = cls(_wait_for_segment(segment_name(symbol, stream)), len(fields))
+        ring.records.flags.writeable = False
+        if replay:
+            ring.cursor = max(0, ring.cursor - ring.cap)
+        return ring
+
+    def replacement(self):
+        """
+        Reader only: if a restarted ingester has published a new segment under
+        this ring's name, returns a reader on it (from its first record), else None.
+        """
+        try:
+            shm = _attach_segment(self.shm.name)
+        except FileNotFoundError:
+            return None
+        header = _ring_header(shm.buf)
+        capacity, generation = int(header[1]), int(header[3])
+        del header  # The segment cannot be closed while a view of it exists
+        if not capacity or generation == self.generation:  # Same segment, or not initialised yet
+            shm.close()
+            return None
+        ring = ShmRing(shm, self.records.shape[1])
+        ring.records.flags.writeable = False
+        ring.cursor = 0
+        return ring
+
+    def push(self, record):
+        """Writer only: appends one record, then publishes it by bumping the write count."""
+        count = int(self.header[0])
+        self.records[count % self.cap] = record
+        self.header[0] = count + 1
+
+    def read_new(self):
+        """Reader only: returns a copy of every record published since the last call."""
+        count = int(self.header[0])
+        start = max(self.cursor, count - self.cap)
+        first, n = start % self.cap, count - start
+        if first + n <= self.cap:
+            out = self.records[first:first + n].copy()
+        else:
+            out = np.concatenate((self.records[first:], self.records[:first + n - self.cap]))
+        # Drop anything the writer overwrote while we were copying. push() writes
+        # slot count % cap before publishing count + 1, so the slot after the
+        # published count may be mid-write and counts as lost too.
+        overrun = int(self.header[0]) + 1 - self.cap - start
+        if overrun > 0:
+            out = out[overrun:]
+        if count != self.cursor:
+            self.last_advance = time.monotonic()
+        self.cursor = count
+        return out
+
+    def close(self, unlink=False):
+        self.records = self.header = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def poll_rings(handlers, interval=0.05, on_replaced=None):
+    """
+    Reader loop: calls handler(records) for every (ring, handler) pair with new records, forever.
+
+    Each pass reads the rings from last to first, then calls the handlers from
+    first to last. The ingester pushes in arrival order, so a handler always
+    sees every record of the rings listed before it that arrived ahead of its
+    own records: list a ring that closes out a period (kline confirms) after
+    the rings it aggregates (trades, BBO).
+
+    A ring that has not advanced for RING_STALE_SECONDS is checked for a
+    restarted ingester; if one has published new segments, the loop re-attaches
+    to them and calls on_replaced(new_ring), if given.
+    """
+    handlers = list(handlers)
+    while True:
+        batches = [ring.read_new() for ring, _ in reversed(handlers)][::-1]
+        for i, ((ring, handler), records) in enumerate(zip(handlers, batches)):
+            if len(records):
+                try:
+                    handler(records)
+                except Exception as e:
+                    logging.error(f"Error handling {len(records)} ingester records: {e}")
+            elif time.monotonic() - ring.last_advance > RING_STALE_SECONDS:
+                new_ring = ring.replacement()
+                if new_ring is None:
+                    if not ring.owner_exit_logged and not _pid_alive(ring.owner_pid):
+                        logging.warning(f"Ingester pid {ring.owner_pid} has exited; waiting for it to be restarted...")
+                        ring.owner_exit_logged = True
+                    ring.last_advance = time.monotonic()  # Check again after another stale period
+                    continue
+                logging.warning(f"Ingester was restarted (pid {new_ring.owner_pid}); re-attaching to '{ring.shm.name}'.")
+                ring.close()
+                handlers[i] = (new_ring, handler)
+                if on_replaced is not None:
+                    on_replaced(new_ring)
+        time.sleep(interval)
+
+
+# --- Shared Depth Book ---
+
+def attach_book(symbol):
+    """
+    Returns (shm, book) for the ingester's depth book; the book view is read-only.
+    book_generation(book) identifies the ingester run that owns it.
+    """
+    shm = _wait_for_segment(segment_name(symbol, "depth"))
+    book = np.ndarray(BOOK_SHAPE, dtype=np.float64, buffer=shm.buf)
+    book.flags.writeable = False
+    return shm, book
+
+def book_generation(book):
+    return int(book[0, 4])
+
+def read_book(book):
+    """Returns a consistent copy of the depth book as (bid_px, bid_sz, ask_px, ask_sz), best level first."""
+    while True:
+        seq = book[0, 0]
+        if seq % 2 == 0:
+            snapshot = book.copy()
+            if book[0, 0] == seq: break
+        time.sleep(0)  # Writer is mid-update; let it finish
+    n_bids, n_asks = int(snapshot[0, 1]), int(snapshot[0, 2])
+    return snapshot[1, :n_bids], snapshot[2, :n_bids], snapshot[3, :n_asks], snapshot[4, :n_asks]
+
+def _parse_levels(levels):
+    """Converts Bybit's [[price_str, size_str], ...] into an (n, 2) float64 array in one C-level call."""
+    return np.array(levels, dtype=np.float64).reshape(-1, 2)
+
+def _load_book_side(px, sz, levels, descending):
+    """Loads snapshot levels into a price/size row pair, best level first. Returns the level count."""
+    levels = _parse_levels(levels)
+    order = np.argsort(-levels[:, 0] if descending else levels[:, 0])[:len(px)]
+    n = len(order)
+    px[:n] = levels[order, 0]
+    sz[:n] = levels[order, 1]
+    return n
+
+@njit(cache=True)
+def _apply_book_levels(px, sz, n, levels, descending):
+    """Applies parsed delta levels to a sorted price/size row pair in place. Returns the new level count."""
+    cap = px.shape[0]
+    for k in range(levels.shape[0]):
+        price = levels[k, 0]
+        size = levels[k, 1]
+
+        # Binary search for the first level that is not better than price
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (px[mid] > price) if descending else (px[mid] < price):
+                lo = mid + 1
+            else:
+                hi = mid
+        i = lo
+
+        if i < n and px[i] == price:
+            if size == 0:  # Level removed: shift the worse levels up
+                for j in range(i, n - 1):
+                    px[j] = px[j + 1]
+                    sz[j] = sz[j + 1]
+                n -= 1
+            else:
+                sz[i] = size
+            continue
+
+        if size == 0 or i >= cap:
+            continue
+        # New level: shift the worse levels down, dropping the last one if full
+        m = min(n, cap - 1)
+        for j in range(m, i, -1):
+            px[j] = px[j - 1]
+            sz[j] = sz[j - 1]
+        px[i] = price
+        sz[i] = size
+        n = m + 1
+    return n
+
+
+# --- WebSocket Ingestion ---
+
+class Ingester:
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.ws = None
+        # Stamped into every segment, so readers attached to a previous run notice the restart
+        self.generation = time.time_ns() // 1000  # Microseconds, exact in the float64 book header too
+        self.rings = {stream: ShmRing.create(symbol, stream, self.generation) for stream in STREAMS}
+
+        self.book_shm = _create_segment(segment_name(symbol, "depth"), np.zeros(BOOK_SHAPE).nbytes,
+                                        lambda buf: int(np.ndarray(BOOK_SHAPE, dtype=np.float64, buffer=buf)[0, 3]))
+        self.book = np.ndarray(BOOK_SHAPE, dtype=np.float64, buffer=self.book_shm.buf)
+        self.book[:] = 0.0
+        self.book[0, 3] = os.getpid()
+        self.book[0, 4] = self.generation
+
+    def handle_kline_message(self, message):
+        ring = self.rings["kline"]
+        for c in message.get("data", []):
+            ring.push((int(c['start']), int(c['end']), float(c['open']), float(c['high']), float(c['low']),
+                       float(c['close']), float(c['volume']), 1.0 if c.get('confirm') else 0.0))
+
+    def handle_trade_message(self, message):
+        ring = self.rings["trades"]
+        for t in message.get("data", []):
+            ring.push((int(t['T']), float(t['p']), float(t['v']), 1.0 if t['S'] == 'Buy' else 0.0))
+
+    def handle_bbo_message(self, message):
+        try:
+            data = message.get("data", {})
+            bids, asks = data.get("b", []), data.get("a", [])
+            if not bids or not asks: return
+            self.rings["bbo"].push((int(message.get("ts")), time.time(), float(bids[0][0]), float(bids[0][1]),
+                                    float(asks[0][0]), float(asks[0][1])))
+        except Exception as e: logging.error(f"Error processing BBO message: {e} - Data: {message}")
+
+    def handle_depth_book_message(self, message):
+        message_type, data = message.get("type"), message.get("data", {})
+        book = self.book
+        bid_px, bid_sz, ask_px, ask_sz = book[1], book[2], book[3], book[4]
+        book[0, 0] += 1
+        try:
+            if message_type == "snapshot":
+                book[0, 1] = _load_book_side(bid_px, bid_sz, data.get("b", []), descending=True)
+                book[0, 2] = _load_book_side(ask_px, ask_sz, data.get("a", []), descending=False)
+            elif message_type == "delta":
+                book[0, 1] = _apply_book_levels(bid_px, bid_sz, int(book[0, 1]), _parse_levels(data.get("b", [])), True)
+                book[0, 2] = _apply_book_levels(ask_px, ask_sz, int(book[0, 2]), _parse_levels(data.get("a", [])), False)
+        except Exception as e: logging.error(f"Error processing Depth {DEPTH_BOOK_LEVELS} message: {e} - Data: {message}")
+        finally:
+            book[0, 0] += 1
+
+    def connect(self):
+        # Compile the book kernel before the first delta arrives
+        _apply_book_levels(np.zeros(1), np.zeros(1), 0, np.zeros((0, 2)), True)
+        if use_fast_json(): logging.info("Decoding WebSocket frames with orjson.")
+        logging.info(f"Connecting ingester WebSocket for {self.symbol}...")
+        while True:
+            try:
+                self.ws = RawDeltaWebSocket(testnet=False, channel_type="linear", raw_depths=(DEPTH_BOOK_LEVELS,))
+                self.ws.kline_stream(interval=1, symbol=self.symbol, callback=self.handle_kline_message)
+                self.ws.trade_stream(symbol=self.symbol, callback=self.handle_trade_message)
+                self.ws.orderbook_stream(depth=1, symbol=self.symbol, callback=self.handle_bbo_message)
+                self.ws.orderbook_stream(depth=DEPTH_BOOK_LEVELS, symbol=self.symbol, callback=self.handle_depth_book_message)
+                logging.info(f"Ingester subscribed to kline.1, publicTrade, orderbook.1 and orderbook.{DEPTH_BOOK_LEVELS} for {self.symbol}")
+                break
+            except Exception as e:
+                logging.error(f"Failed to connect ingester WebSocket: {e}. Retrying in 30 seconds...")
+                time.sleep(30)
+
+    def run(self):
+        self.connect()
+        try:
+            while True: time.sleep(60)
+        except KeyboardInterrupt:
+            logging.info("Ingester stopped.")
+        finally:
+            if self.ws: self.ws.exit()
+            for ring in self.rings.values(): ring.close(unlink=True)
+            self.book = None
+            self.book_shm.close()
+            self.book_shm.unlink()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    Ingester(symbol=sys.argv[1] if len(sys.argv) > 1 else SYMBOL).run()
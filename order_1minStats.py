@@ -1,116 +1,95 @@
+import math
 import time
 import threading
 import datetime  # <-- CHANGED
-from pybit.unified_trading import WebSocket
-from collections import deque
 import numpy as np
+import ingester
+from soa_ring import SoARing
 
 # --- Configuration ---
-SYMBOL = "POPCATUSDT"
-DEPTH = 1
+SYMBOL = "POPCATUSDT"  # BBO updates come from the ingester's orderbook.1 stream
+BBO_RING_CAPACITY = 65536  # Sized for a peak minute of BBO updates
+PERIOD_SECONDS = 60
 # AGGREGATION_PERIOD_SECONDS is no longer needed, loop is clock-driven
 
-# --- Global variables (Unchanged) ---
+# --- Global variables ---
 data_lock = threading.Lock()
-bbo_updates = deque()
+# BBO updates as parallel arrays; time is the UNIX receipt timestamp (float), non-decreasing
+bbo_ring = SoARing(BBO_RING_CAPACITY, time='f8', mid_price='f8', spread='f8', imbalance_ratio='f8',
+                   bid_tick=bool, ask_tick=bool)
 last_bid_price = 0.0
 last_ask_price = 0.0
 
-# --- WebSocket Message Handler (Unchanged) ---
-def handle_bbo_message(message):
+# --- Ingester Record Handler ---
+def handle_bbo_records(records):
     global last_bid_price, last_ask_price
     
-    if message["type"] == "snapshot":
-        try:
-            bid_data = message["data"]["b"]
-            ask_data = message["data"]["a"]
-            
-            if not bid_data or not ask_data:
-                return
+    # Columns follow ingester.BBO_FIELDS; the whole block is computed at once
+    received_at = records[:, 1]
+    bid_price, bid_size = records[:, 2], records[:, 3]
+    ask_price, ask_size = records[:, 4], records[:, 5]
 
-            bid_price = float(bid_data[0][0])
-            bid_size = float(bid_data[0][1])
-            ask_price = float(ask_data[0][0])
-            ask_size = float(ask_data[0][1])
+    spread = ask_price - bid_price
+    mid_price = (ask_price + bid_price) / 2.0
+    total_bbo_volume = bid_size + ask_size
+    imbalance_ratio = np.divide(bid_size, total_bbo_volume, out=np.full(len(records), 0.5),
+                                where=total_bbo_volume > 0)
 
-            spread = ask_price - bid_price
-            mid_price = (ask_price + bid_price) / 2.0
-            total_bbo_volume = bid_size + ask_size
-            
-            if total_bbo_volume > 0:
-                imbalance_ratio = bid_size / total_bbo_volume
-            else:
-                imbalance_ratio = 0.5 
+    # A tick is a change from the previous update's price, including across blocks
+    bid_tick = bid_price != np.concatenate(([last_bid_price], bid_price[:-1]))
+    ask_tick = ask_price != np.concatenate(([last_ask_price], ask_price[:-1]))
 
-            bid_tick = (bid_price != last_bid_price)
-            ask_tick = (ask_price != last_ask_price)
-            
-            last_bid_price = bid_price
-            last_ask_price = ask_price
-
-            with data_lock:
-                bbo_updates.append({
-                    "time": time.time(), # This is a float (UNIX timestamp)
-                    "mid_price": mid_price,
-                    "spread": spread,
-                    "imbalance_ratio": imbalance_ratio,
-                    "bid_tick": bid_tick,
-                    "ask_tick": ask_tick
-                })
-
-        except Exception as e:
-            print(f"Error processing message: {e} - Data: {message}")
+    last_bid_price = float(bid_price[-1])
+    last_ask_price = float(ask_price[-1])
+
+    with data_lock:
+        bbo_ring.extend(
+            time=received_at, # UNIX timestamps (float)
+            mid_price=mid_price,
+            spread=spread,
+            imbalance_ratio=imbalance_ratio,
+            bid_tick=bid_tick,
+            ask_tick=ask_tick
+        )
 
 # --- Aggregation and Reporting Function (CHANGED) ---
-def process_and_report():
+def process_and_report(period_end_ts):
     """
     This function is called by the main thread AT THE START of every minute
     (e.g., at 16:06:00.001) to process data from the PREVIOUS minute
     (e.g., 16:05:00.000 to 16:05:59.999).
+
+    period_end_ts is the UNIX timestamp of the minute boundary just reached
+    (e.g., 16:06:00), as computed by the scheduling loop.
     """
     
-    # 1. Calculate the timestamps for the *previous* full minute
-    now = datetime.datetime.now()
-    # This is the timestamp for the *start* of the current minute (e.g., 16:06:00)
-    current_minute_start_dt = now.replace(second=0, microsecond=0)
-    # This is the timestamp for the *start* of the minute we want to report on (e.g., 16:05:00)
-    period_start_dt = current_minute_start_dt - datetime.timedelta(minutes=1)
-    
-    # Get the float timestamps for comparison
-    period_start_ts = period_start_dt.timestamp()
-    period_end_ts = current_minute_start_dt.timestamp() # End is the start of the *next* minute
+    # 1. The *previous* full minute ends at the boundary (exclusive)
+    period_start_ts = period_end_ts - PERIOD_SECONDS
     
     # Get human-readable strings for the report
-    period_start_str = period_start_dt.strftime('%H:%M:%S')
+    period_start_str = datetime.datetime.fromtimestamp(period_start_ts).strftime('%H:%M:%S')
     # End time is 59 seconds (e.g., 16:05:59)
-    period_end_str = (current_minute_start_dt - datetime.timedelta(seconds=1)).strftime('%H:%M:%S')
+    period_end_str = datetime.datetime.fromtimestamp(period_end_ts - 1).strftime('%H:%M:%S')
 
-    # 2. Atomically drain the deque of all data from the target period
-    updates_to_process = []
+    # 2. Atomically drain the ring of all data from the target period
     with data_lock:
-        # Efficiently pop all items that are OLDER than the start of the *current* minute
-        # (i.e., everything from 16:05:59.999 and earlier)
-        while bbo_updates and bbo_updates[0]["time"] < period_end_ts:
-            update = bbo_updates.popleft()
-            
-            # Only append items that are *also* from *within* our target minute
-            # (i.e., 16:05:00.000 or later)
-            if update["time"] >= period_start_ts:
-                updates_to_process.append(update)
+        # Consume everything OLDER than the start of the *current* minute
+        # (i.e., everything from 16:05:59.999 and earlier), keeping only what is
+        # *also* from *within* our target minute (i.e., 16:05:00.000 or later)
+        window = bbo_ring.drain_window(period_start_ts, period_end_ts)
 
     # 3. Process the snapshot
-    if not updates_to_process:
-        print(f"\n[{now.strftime('%H:%M:%S')}] No BBO updates received for period {period_start_str} - {period_end_str}.")
+    num_updates = len(window["time"])
+    if not num_updates:
+        print(f"\n[{datetime.datetime.fromtimestamp(period_end_ts).strftime('%H:%M:%S')}] No BBO updates received for period {period_start_str} - {period_end_str}.")
         return
 
-    num_updates = len(updates_to_process)
-    
-    mid_prices = np.array([d['mid_price'] for d in updates_to_process])
-    spreads = np.array([d['spread'] for d in updates_to_process])
-    imbalances = np.array([d['imbalance_ratio'] for d in updates_to_process])
+    mid_prices = window["mid_price"]
+    spreads = window["spread"]
+    imbalances = window["imbalance_ratio"]
     
-    bid_ticks = sum(d['bid_tick'] for d in updates_to_process)
-    ask_ticks = sum(d['ask_tick'] for d in updates_to_process)
+    bid_ticks = int(np.count_nonzero(window["bid_tick"]))
+    ask_ticks = int(np.count_nonzero(window["ask_tick"]))
     total_ticks = bid_ticks + ask_ticks
 
     avg_mid_price = np.mean(mid_prices)
@@ -139,32 +118,34 @@ def process_and_report():
 
 # --- Main Script Logic (CHANGED) ---
 if __name__ == "__main__":
-    print(f"Connecting to Bybit WebSocket for {SYMBOL} (Depth: {DEPTH})...")
+    print(f"Attaching to ingester BBO stream for {SYMBOL}...")
     print(f"Aggregating data into 1-minute (00-59s) clock-aligned periods.") # <-- CHANGED
     
-    ws = WebSocket(testnet=False, channel_type="linear")
-    ws.orderbook_stream(depth=DEPTH, symbol=SYMBOL, callback=handle_bbo_message)
+    bbo_records = ingester.ShmRing.attach(SYMBOL, "bbo")
+    threading.Thread(target=ingester.poll_rings, args=([(bbo_records, handle_bbo_records)],), daemon=True).start()
     
-    # Wait a few seconds for the connection to establish and data to start flowing
+    # Wait a few seconds for data to start flowing
     print("Waiting for first data...")
     time.sleep(5) 
     
     print("Starting clock-aligned aggregation loop...")
+    # Anchor the monotonic clock to wall-clock time once, so minute boundaries
+    # are scheduled without drift and without being moved by NTP corrections
+    epoch_offset = time.time() - time.monotonic()
+    next_boundary = math.ceil((time.monotonic() + epoch_offset) / PERIOD_SECONDS) * PERIOD_SECONDS
     try:
         while True:
-            # 1. Calculate time until the *next* minute starts
-            now = datetime.datetime.now()
-            seconds_until_next_minute = 60 - (now.second + now.microsecond / 1_000_000)
+            # 1. Sleep until the *next* minute starts
+            time.sleep(max(0.0, next_boundary - epoch_offset - time.monotonic()))
             
-            # 2. Sleep until that precise moment
-            time.sleep(seconds_until_next_minute)
-            
-            # 3. At the start of the new minute (e.g., 16:06:00.000),
+            # 2. At the start of the new minute (e.g., 16:06:00.000),
             #    process the data from the *previous* minute (16:05:00-16:05:59)
-            process_and_report()
+            process_and_report(next_boundary)
+
+            # 3. Advance by whole periods; if the process was stalled, skip the
+            #    missed boundaries rather than firing them back to back
+            now = time.monotonic() + epoch_offset
+            next_boundary += PERIOD_SECONDS * max(1, math.ceil((now - next_boundary) / PERIOD_SECONDS))
             
     except KeyboardInterrupt:
-        print("\n🛑 Exiting script.")
-    finally:
-        ws.exit()
-        print("WebSocket disconnected.")
\ No newline at end of file
+        print("\n🛑 Exiting script.")
\ No newline at end of file
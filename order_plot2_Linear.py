@@ -1,75 +1,182 @@
-import time
-from pybit.unified_trading import WebSocket
+import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-from collections import OrderedDict
+from matplotlib import cbook
+from matplotlib.collections import PolyCollection
+from sortedcontainers import SortedDict
+import pybit_fast
+from plot_helpers import MessageQueue, figure_hidden
 
 # --- Configuration ---
 SYMBOL = "POPCATUSDT"
 DEPTH = 200
+INDICATOR_EVERY_N_FRAMES = 5  # The imbalance bar moves slowly, so it is refreshed less often
+MIN_XLIM_MARGIN = 0.0005  # Narrowest half-width of the depth chart's price window
+XLIM_CENTER_STEPS = 4     # The window center moves in steps of margin / XLIM_CENTER_STEPS
 
 # --- Global variables ---
-bids = OrderedDict()
-asks = OrderedDict()
+# Kept sorted by price on every insert/delete, so frames never re-sort the book
+bids = SortedDict()
+asks = SortedDict()
+# Running liquidity totals, maintained with each book change
+total_bid_volume = 0.0
+total_ask_volume = 0.0
 snapshot_received = False
+# Set whenever the book changes, cleared once a frame has drawn it
+dirty = False
+
+# Raw book messages, applied on the GUI thread at the start of each frame
+message_queue = MessageQueue()
+
+# --- WebSocket Message Handler ---
+def drain_message_queue():
+    """Applies every queued message to the book, in arrival order."""
+    for message in message_queue.drain():
+        handle_orderbook_message(message)
+
+def apply_delta_side(book, levels):
+    """Applies one side of a delta in bulk and returns the change in that side's total volume."""
+    # Later levels for the same price win, as if applied one by one
+    parsed = {float(p): float(q) for p, q in levels}
+    old = book.get
+    volume_change = sum(q - old(p, 0.0) for p, q in parsed.items())
+    book.update({p: q for p, q in parsed.items() if q})
+    for p in [p for p, q in parsed.items() if not q]:
+        book.pop(p, None)
+    return volume_change
 
-# --- WebSocket Message Handler (No changes here) ---
 def handle_orderbook_message(message):
-    global bids, asks, snapshot_received
+    global bids, asks, snapshot_received, total_bid_volume, total_ask_volume, dirty
     if message["type"] == "snapshot":
         bids.clear(); asks.clear()
-        for p, q in message["data"]["b"]: bids[float(p)] = float(q)
-        for p, q in message["data"]["a"]: asks[float(p)] = float(q)
+        bids.update({float(p): float(q) for p, q in message["data"]["b"]})
+        asks.update({float(p): float(q) for p, q in message["data"]["a"]})
+        total_bid_volume = sum(bids.values())
+        total_ask_volume = sum(asks.values())
         snapshot_received = True
+        dirty = True
         print("✅ Order book snapshot received. Plotting real-time depth...")
     elif message["type"] == "delta":
         if not snapshot_received: return
-        for p, q in message["data"]["b"]:
-            price, qty = float(p), float(q)
-            if qty == 0:
-                if price in bids: del bids[price]
-            else: bids[price] = qty
-        for p, q in message["data"]["a"]:
-            price, qty = float(p), float(q)
-            if qty == 0:
-                if price in asks: del asks[price]
-            else: asks[price] = qty
-
-# --- Animation Update Function (UPDATED) ---
-def update_plot(frame, ax_depth, ax_indicator):
-    """This function is called repeatedly to redraw both the depth chart and the imbalance bar."""
-    if not snapshot_received:
-        ax_depth.set_title(f'Waiting for {SYMBOL} Order Book Snapshot...')
-        return
+        total_bid_volume += apply_delta_side(bids, message["data"]["b"])
+        total_ask_volume += apply_delta_side(asks, message["data"]["a"])
+        dirty = True
 
-    # --- 1. Update the Main Depth Chart (ax_depth) ---
-    sorted_bids = OrderedDict(sorted(bids.items(), reverse=True))
-    sorted_asks = OrderedDict(sorted(asks.items()))
-    bid_prices = list(sorted_bids.keys())
-    bid_vols = [sum(list(sorted_bids.values())[:i+1]) for i in range(len(sorted_bids))]
-    ask_prices = list(sorted_asks.keys())
-    ask_vols = [sum(list(sorted_asks.values())[:i+1]) for i in range(len(sorted_asks))]
-    
-    ax_depth.clear()
-    ax_depth.step(bid_prices, bid_vols, color='green', where='pre', label='Bids (Buy Orders)')
-    ax_depth.step(ask_prices, ask_vols, color='red', where='pre', label='Asks (Sell Orders)')
-    ax_depth.fill_between(bid_prices, bid_vols, step="pre", alpha=0.2, color='green')
-    ax_depth.fill_between(ask_prices, ask_vols, step="pre", alpha=0.2, color='red')
-    ax_depth.set_title(f'Real-Time Order Book Depth for {SYMBOL} Perpetual')
+# --- Plot Setup ---
+def create_artists(ax_depth, ax_indicator):
+    """
+    Creates the depth and imbalance artists once. They are animated, so each
+    frame only their data changes and blitting redraws them over a cached background.
+    """
+    bid_line, = ax_depth.step([], [], color='green', where='pre', label='Bids (Buy Orders)', animated=True)
+    ask_line, = ax_depth.step([], [], color='red', where='pre', label='Asks (Sell Orders)', animated=True)
+    bid_fill = ax_depth.add_collection(PolyCollection([], alpha=0.2, color='green', animated=True))
+    ask_fill = ax_depth.add_collection(PolyCollection([], alpha=0.2, color='red', animated=True))
+    ax_depth.set_title(f'Waiting for {SYMBOL} Order Book Snapshot...')
     ax_depth.set_xlabel('Price (USDT)')
     ax_depth.set_ylabel('Cumulative Volume')
     ax_depth.legend(loc='upper left')
     ax_depth.grid(True, linestyle='--', alpha=0.6)
+
+    # Green "Bids" part of the bar, then the red "Asks" part starting where the green part ends
+    bid_bar = ax_indicator.barh([0], [0.5], color='green', height=1)[0]
+    ask_bar = ax_indicator.barh([0], [0.5], left=0.5, color='red', height=1)[0]
+    # Text labels for clarity (one line, so blitting does not clip them to the thin axes)
+    bid_text = ax_indicator.text(0.25, 0, '', color='white', ha='center', va='center', weight='bold')
+    ask_text = ax_indicator.text(0.75, 0, '', color='white', ha='center', va='center', weight='bold')
+    for artist in (bid_bar, ask_bar, bid_text, ask_text):
+        artist.set_animated(True)
+    ax_indicator.set_title('Liquidity Imbalance')
+    ax_indicator.set_xlim(0, 1)
+    ax_indicator.set_yticks([]) # Hide the y-axis ticks
+
+    return {
+        'bid_line': bid_line, 'ask_line': ask_line, 'bid_fill': bid_fill, 'ask_fill': ask_fill,
+        'bid_bar': bid_bar, 'ask_bar': ask_bar, 'bid_text': bid_text, 'ask_text': ask_text,
+    }
+
+def step_fill_verts(x, y):
+    """Outline of fill_between(x, y, step='pre') as a single polygon."""
+    if not len(x):
+        return np.zeros((0, 2))
+    xs, ys = cbook.pts_to_prestep(x, y)
+    return np.column_stack([np.r_[xs[0], xs, xs[-1]], np.r_[0.0, ys, 0.0]])
+
+# --- Animation Update Function (UPDATED) ---
+def update_depth_chart(ax_depth, artists):
+    """Redraws the depth curves from the book; returns True if the figure background changed."""
+    # Limits, ticks and the title are part of the cached background; when one
+    # of them changes the whole figure is redrawn once
+    needs_redraw = False
+    if ax_depth.get_title() != f'Real-Time Order Book Depth for {SYMBOL} Perpetual':
+        ax_depth.set_title(f'Real-Time Order Book Depth for {SYMBOL} Perpetual')
+        needs_redraw = True
+
+    # --- 1. Update the Main Depth Chart (ax_depth) ---
+    # Best price first on both sides (bids descending, asks ascending);
+    # cumulative volume in one vectorized pass
+    n_bids, n_asks = len(bids), len(asks)
+    bid_prices = np.fromiter(reversed(bids.keys()), dtype=np.float64, count=n_bids)
+    bid_vols = np.cumsum(np.fromiter(reversed(bids.values()), dtype=np.float64, count=n_bids))
+    ask_prices = np.fromiter(asks.keys(), dtype=np.float64, count=n_asks)
+    ask_vols = np.cumsum(np.fromiter(asks.values(), dtype=np.float64, count=n_asks))
     
-    if bid_prices and ask_prices:
+    artists['bid_line'].set_data(bid_prices, bid_vols)
+    artists['ask_line'].set_data(ask_prices, ask_vols)
+    artists['bid_fill'].set_verts([step_fill_verts(bid_prices, bid_vols)])
+    artists['ask_fill'].set_verts([step_fill_verts(ask_prices, ask_vols)])
+    
+    if len(bid_prices) and len(ask_prices):
         spread = ask_prices[0] - bid_prices[0]
         center = bid_prices[0] + spread / 2
-        margin = max(spread * 5, 0.0005)
-        ax_depth.set_xlim(center - margin, center + margin)
+        # Snap the window to a coarse grid (the margin to a power-of-two multiple
+        # of the minimum, the center to a fraction of the margin), so small moves
+        # of the mid price or spread keep the same limits and skip the redraw
+        margin = max(spread * 5, MIN_XLIM_MARGIN)
+        margin = MIN_XLIM_MARGIN * 2.0 ** np.ceil(np.log2(margin / MIN_XLIM_MARGIN))
+        step = margin / XLIM_CENTER_STEPS
+        center = round(center / step) * step
+        if ax_depth.get_xlim() != (center - margin, center + margin):
+            ax_depth.set_xlim(center - margin, center + margin)
+            needs_redraw = True
+
+        # Grow the y axis as soon as the book outgrows it, shrink it only once
+        # the book is less than half its height
+        top = max(bid_vols[-1], ask_vols[-1]) * 1.05
+        y_top = ax_depth.get_ylim()[1]
+        if top > y_top or top < y_top / 2:
+            ax_depth.set_ylim(0, top)
+            needs_redraw = True
+
+    return needs_redraw
+
+def update_plot(frame, ax_depth, ax_indicator, artists):
+    """This function is called repeatedly to update both the depth chart and the imbalance bar."""
+    global dirty
+    drain_message_queue()
+    # Messages are still applied while the window is hidden, but nothing is drawn;
+    # the dirty flag stays set, so the first visible frame catches up
+    if not snapshot_received or figure_hidden(ax_depth.figure):
+        return []
+
+    depth_artists = [artists['bid_line'], artists['ask_line'], artists['bid_fill'], artists['ask_fill']]
+    indicator_artists = [artists['bid_bar'], artists['ask_bar'], artists['bid_text'], artists['ask_text']]
+
+    # Nothing changed since the last frame: the artists keep their data, and
+    # blitting still needs them returned to paint them back over the background
+    needs_redraw = False
+    if dirty:
+        dirty = False
+        needs_redraw = update_depth_chart(ax_depth, artists)
+        if needs_redraw:
+            ax_depth.figure.canvas.draw()
+
+    # Blitting restores the background under every returned artist each frame,
+    # so the indicator is still returned, just recomputed less often
+    if frame % INDICATOR_EVERY_N_FRAMES and not needs_redraw:
+        return depth_artists + indicator_artists
 
     # --- 2. Calculate and Update the Imbalance Indicator (ax_indicator) ---
-    total_bid_volume = sum(bids.values())
-    total_ask_volume = sum(asks.values())
     total_liquidity = total_bid_volume + total_ask_volume
 
     if total_liquidity > 0:
@@ -78,25 +185,24 @@ def update_plot(frame, ax_depth, ax_indicator):
     else:
         bid_proportion, ask_proportion = 0.5, 0.5 # Default to 50/50 if no data
 
-    ax_indicator.clear()
-    # Draw the green "Bids" part of the bar
-    ax_indicator.barh([0], [bid_proportion], color='green', height=1)
-    # Draw the red "Asks" part, starting where the green part ends
-    ax_indicator.barh([0], [ask_proportion], left=bid_proportion, color='red', height=1)
-    
-    # Add text labels for clarity
-    ax_indicator.text(bid_proportion / 2, 0, f'Bids\n{bid_proportion:.1%}', color='white', ha='center', va='center', weight='bold')
-    ax_indicator.text(bid_proportion + ask_proportion / 2, 0, f'Asks\n{ask_proportion:.1%}', color='white', ha='center', va='center', weight='bold')
-    
-    ax_indicator.set_title('Liquidity Imbalance')
-    ax_indicator.set_xlim(0, 1)
-    ax_indicator.set_yticks([]) # Hide the y-axis ticks
+    artists['bid_bar'].set_width(bid_proportion)
+    artists['ask_bar'].set_x(bid_proportion)
+    artists['ask_bar'].set_width(ask_proportion)
+    artists['bid_text'].set_x(bid_proportion / 2)
+    artists['bid_text'].set_text(f'Bids {bid_proportion:.1%}')
+    artists['ask_text'].set_x(bid_proportion + ask_proportion / 2)
+    artists['ask_text'].set_text(f'Asks {ask_proportion:.1%}')
+
+    return depth_artists + indicator_artists
 
 # --- Main Script Logic ---
 if __name__ == "__main__":
     print(f"Connecting to Bybit WebSocket for {SYMBOL} order book...")
-    ws = WebSocket(testnet=False, channel_type="linear")
-    ws.orderbook_stream(depth=DEPTH, symbol=SYMBOL, callback=handle_orderbook_message)
+    pybit_fast.use_fast_json()  # orjson frame decoding, if installed
+    # Deltas are passed through raw; pybit would otherwise deep-copy the whole
+    # book into a fake snapshot for every message
+    ws = pybit_fast.RawDeltaWebSocket(testnet=False, channel_type="linear", raw_depths=(DEPTH,))
+    ws.orderbook_stream(depth=DEPTH, symbol=SYMBOL, callback=message_queue.put)
     
     # Create the figure and two axes objects
     fig = plt.figure(figsize=(12, 8))
@@ -105,9 +211,12 @@ if __name__ == "__main__":
     # Indicator bar takes up the bottom space
     ax_indicator = plt.subplot2grid((6, 1), (5, 0), rowspan=1, colspan=1)
     
+    artists = create_artists(ax_depth, ax_indicator)
     plt.tight_layout(pad=3.0)
 
-    ani = animation.FuncAnimation(fig, update_plot, fargs=(ax_depth, ax_indicator), interval=500, save_count=0)
+    # blit=True redraws only the animated artists over the cached axes background
+    ani = animation.FuncAnimation(fig, update_plot, fargs=(ax_depth, ax_indicator, artists),
+                                  interval=500, save_count=0, blit=True)
     
     try:
         plt.show()
@@ -0,0 +1,49 @@
+import threading
+from collections import deque
+
+# Helpers shared by the matplotlib scripts (order_plot2_Linear.py and
+# trade_plot2_Linear.py), which feed WebSocket messages into FuncAnimation frames.
+
+
+class MessageQueue:
+    """
+    Hands raw messages from the WebSocket thread to the GUI thread.
+
+    put() is the WebSocket callback and only appends, so the network thread
+    never waits on plotting; each frame takes everything queued since the last
+    one with drain(). Unbounded, because dropping a message (e.g. a book delta)
+    would corrupt the state built from them.
+    """
+    def __init__(self):
+        self._messages = deque()
+        self._lock = threading.Lock()
+
+    def put(self, message):
+        with self._lock:
+            self._messages.append(message)
+
+    def drain(self):
+        """Returns every queued message, in arrival order, and empties the queue."""
+        with self._lock:
+            batch, self._messages = self._messages, deque()
+        return batch
+
+    def clear(self):
+        with self._lock:
+            self._messages.clear()
+
+
+_visibility_note_shown = False  # An unsupported backend is only reported once
+
+def figure_hidden(fig):
+    """True if the figure's window is minimized or hidden; False when the backend cannot tell."""
+    global _visibility_note_shown
+    window = getattr(fig.canvas.manager, 'window', None)
+    if hasattr(window, 'isMinimized'):  # Qt
+        return window.isMinimized() or not window.isVisible()
+    if hasattr(window, 'state'):  # Tk
+        return window.state() in ('iconic', 'withdrawn')
+    if not _visibility_note_shown:
+        print(f"Note: {type(fig.canvas).__name__} cannot report window visibility; frames are drawn even while it is hidden.")
+        _visibility_note_shown = True
+    return False
@@ -0,0 +1,45 @@
+import json
+import types
+from pybit import _websocket_stream
+from pybit.unified_trading import WebSocket
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; pybit then keeps decoding with the stdlib json
+    orjson = None
+
+# pybit speed-ups shared by ingester.py and the scripts that open their own
+# WebSocket. Kept free of the ingester's NumPy/shared-memory imports.
+
+
+def use_fast_json():
+    """
+    Makes pybit decode incoming frames with orjson, if it is installed. Returns True if so.
+
+    pybit parses every frame through its module-level json name. orjson.dumps
+    returns bytes, so outgoing subscription messages stay on the stdlib encoder.
+    """
+    if orjson is None:
+        return False
+    _websocket_stream.json = types.SimpleNamespace(loads=orjson.loads, dumps=json.dumps)
+    return True
+
+
+class RawDeltaWebSocket(WebSocket):
+    """
+    pybit WebSocket that hands depth-book deltas to the callback untouched.
+
+    Stock pybit rebuilds its own copy of the book with list scans and deep-copies
+    it into a fake snapshot for every message; callers that keep their own
+    sorted book skip all of that work for the orderbook topics of raw_depths.
+    Other depths keep pybit's handling.
+    """
+    def __init__(self, *args, raw_depths, **kwargs):
+        self.raw_topic_prefixes = tuple(f"orderbook.{depth}." for depth in raw_depths)
+        super().__init__(*args, **kwargs)
+
+    def _process_normal_message(self, message):
+        if message["topic"].startswith(self.raw_topic_prefixes):
+            self._get_callback(message["topic"])(message)
+        else:
+            super()._process_normal_message(message)
@@ -0,0 +1,78 @@
+import numpy as np
+
+# Preallocated ring buffer of records stored as parallel NumPy arrays
+# (structure of arrays), shared by OrderF_HAFlags.py, trade_exhaust2.py and
+# order_1minStats.py.
+
+
+class SoARing:
+    """
+    Ring buffer with one preallocated NumPy array per column.
+
+    Columns are given as name=dtype; the first one is the sort key, and
+    records must be appended with non-decreasing keys. One writer and one
+    reader; callers on different threads serialise them with a lock. When the
+    ring is full the oldest record is overwritten.
+    """
+    def __init__(self, cap, **dtypes):
+        self.cap = cap
+        self.columns = {name: np.zeros(cap, dtype=dtype) for name, dtype in dtypes.items()}
+        self.key = next(iter(self.columns))
+        # Monotonic counters; the physical slot is counter % cap
+        self.head = 0
+        self.tail = 0
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def push(self, **values):
+        """Appends one record."""
+        i = self.tail % self.cap
+        for name, value in values.items():
+            self.columns[name][i] = value
+        self._advance(1)
+
+    def extend(self, **columns):
+        """Appends equal-length column arrays with at most two slice copies per column."""
+        n = len(columns[self.key])
+        if n > self.cap:  # Only the newest cap records can survive anyway
+            self.tail += n - self.cap
+            columns = {name: values[-self.cap:] for name, values in columns.items()}
+            n = self.cap
+        start = self.tail % self.cap
+        first = min(n, self.cap - start)
+        for name, values in columns.items():
+            col = self.columns[name]
+            col[start:start + first] = values[:first]
+            col[:n - first] = values[first:]
+        self._advance(n)
+
+    def _advance(self, n):
+        self.tail += n
+        if self.tail - self.head > self.cap:
+            self.head = self.tail - self.cap
+
+    def consume(self, k):
+        """Drops the k oldest records."""
+        self.head += k
+
+    def _slice(self, col, first, count):
+        """Returns count records from logical position first, as a view unless it wraps."""
+        first %= self.cap
+        if first + count <= self.cap:
+            return col[first:first + count]
+        return np.concatenate((col[first:], col[:first + count - self.cap]))
+
+    def drain_window(self, start, end):
+        """
+        Consumes every record with key < end and returns the ones with
+        key >= start as a dict of column arrays.
+
+        The arrays are views into the ring unless the range wraps around, so
+        use them before more records are appended.
+        """
+        keys = self._slice(self.columns[self.key], self.head, len(self))
+        lo, hi = np.searchsorted(keys, [start, end])
+        window = {name: self._slice(col, self.head + lo, hi - lo) for name, col in self.columns.items()}
+        self.head += int(hi)
+        return window
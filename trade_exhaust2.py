@@ -1,29 +1,101 @@
 import logging
-import time
-import collections
-import statistics
+import math
+import queue
+import threading
 import datetime
+import numpy as np
 from pybit.unified_trading import WebSocket
+import pybit_fast
+from soa_ring import SoARing
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; candles are then only logged
+    pa = None
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the kernels below then run as plain Python
+    def njit(*args, **kwargs):
+        return lambda func: func
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+TRADE_RING_CAPACITY = 65536  # Sized for a peak minute of trades
+CANDLE_PARQUET_DIR = "candles"  # Parquet dataset root, partitioned by UTC date
+PARQUET_FLUSH_CANDLES = 60      # Candles buffered per Parquet file
+
+if pa is not None:
+    CANDLE_SCHEMA = pa.schema([
+        ("candle_start", pa.timestamp("ms", tz="UTC")),
+        ("close_price", pa.float64()),
+        ("buy_volume", pa.float64()),
+        ("sell_volume", pa.float64()),
+        ("total_volume", pa.float64()),
+        ("delta", pa.float64()),
+        ("agg_ratio", pa.float64()),
+        ("cumulative_volume_delta", pa.float64()),
+        ("cvd_zscore_ratio", pa.float64()),
+        ("date", pa.string()),
+    ])
+
+
+@njit(cache=True)
+def _sum_by_side(vol, side, lo, hi):
+    """Returns (buy_volume, sell_volume) of trades lo..hi-1 in one compiled pass."""
+    buy_volume = 0.0
+    sell_volume = 0.0
+    for i in range(lo, hi):
+        if side[i]:
+            buy_volume += vol[i]
+        else:
+            sell_volume += vol[i]
+    return buy_volume, sell_volume
+
+
 class OrderFlowTracker:
-    def __init__(self, symbol, cvd_zscore_period=100):
+    def __init__(self, symbol, cvd_zscore_period=100, parquet_dir=CANDLE_PARQUET_DIR):
         self.symbol = symbol
         self.ws = None
+        # Candle rows waiting to be written to Parquet (unused without pyarrow).
+        # Full batches go to a writer thread, so disk writes never block the
+        # WebSocket callbacks; None on the queue stops it.
+        self.parquet_dir = parquet_dir
+        self._candle_rows = []
+        self._parquet_batches = queue.Queue()
+        self._parquet_writer = None
+        if pa is not None:
+            self._parquet_writer = threading.Thread(target=self._write_parquet_batches, daemon=True)
+            self._parquet_writer.start()
         
-        self.trade_buffer = [] 
+        # Trades parsed once at ingest into parallel arrays; they arrive time-ordered
+        self.trade_buffer = SoARing(TRADE_RING_CAPACITY, ts='i8', vol='f8', side='u1')  # side: 1 = Buy, 0 = Sell
         
         # Inter-candle state
         self.cumulative_volume_delta = 0.0
-        self.cvd_history = collections.deque(maxlen=cvd_zscore_period)
+        # Last cvd_zscore_period CVD values in a preallocated ring; the oldest
+        # value sits at _cvd_idx once the ring is full
+        self.cvd_history = np.zeros(cvd_zscore_period, dtype=np.float64)
+        self._cvd_idx = 0
+        self._cvd_len = 0
         self.cvd_zscore_period = cvd_zscore_period
+        # Running mean and sum of squared deviations of the window (Welford),
+        # updated in O(1) as values enter and leave the window
+        self._cvd_mean = 0.0
+        self._cvd_m2 = 0.0
         
         self.last_kline_start_time = None
+        # Set by stop(); run() waits on it
+        self._stop = threading.Event()
 
     def connect(self):
+        # Compile the aggregation kernel now so the first candle is not delayed by the JIT
+        _sum_by_side(np.zeros(1), np.zeros(1, dtype=np.uint8), 0, 0)
+
         logging.info("Connecting to Bybit WebSocket...")
+        if pybit_fast.use_fast_json(): logging.info("Decoding WebSocket frames with orjson.")
         self.ws = WebSocket(
             testnet=False,
             channel_type="linear",
@@ -34,13 +106,46 @@ class OrderFlowTracker:
 
     def run(self):
         self.connect()
-        while True:
-            time.sleep(60)
+        try:
+            # A timed wait, so Ctrl-C is also delivered on Windows, where a
+            # bare wait() cannot be interrupted; it still only wakes once a second
+            while not self._stop.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            logging.info("Interrupted, shutting down.")
+        finally:
+            self.ws.exit()
+            logging.info("WebSocket disconnected.")
+            self.flush_candles()
+            if self._parquet_writer is not None:
+                self._parquet_batches.put(None)
+                self._parquet_writer.join()
+
+    def flush_candles(self):
+        """Hands the buffered candle rows to the writer thread."""
+        if pa is None or not self._candle_rows:
+            return
+        rows, self._candle_rows = self._candle_rows, []
+        self._parquet_batches.put(rows)
+
+    def _write_parquet_batches(self):
+        """Writer thread: writes each batch to the Parquet dataset as one file per date."""
+        while (rows := self._parquet_batches.get()) is not None:
+            try:
+                table = pa.Table.from_pylist(rows, schema=CANDLE_SCHEMA)
+                pq.write_to_dataset(table, root_path=self.parquet_dir, partition_cols=["date"])
+                logging.info(f"Wrote {len(rows)} candles to {self.parquet_dir}")
+            except Exception as e:
+                logging.error(f"Failed to write {len(rows)} candles to {self.parquet_dir}: {e}")
+
+    def stop(self):
+        """Makes run() return; safe to call from any thread."""
+        self._stop.set()
 
     def handle_trade_message(self, message):
         """Callback function to handle incoming trade messages."""
         for trade in message.get("data", []):
-            self.trade_buffer.append(trade)
+            self.trade_buffer.push(ts=int(trade['T']), vol=float(trade['v']), side=trade['S'] == 'Buy')
 
     def handle_kline_message(self, message):
         """Callback function to handle incoming kline messages."""
@@ -55,31 +160,46 @@ class OrderFlowTracker:
                 self.last_kline_start_time = candle['start']
                 self.process_candle_data(candle)
 
+    def _push_cvd(self, value):
+        """Appends value to cvd_history, updating the running mean and M2 for the window."""
+        history = self.cvd_history
+        i = self._cvd_idx
+        if self._cvd_len < len(history):
+            self._cvd_len += 1
+            delta = value - self._cvd_mean
+            self._cvd_mean += delta / self._cvd_len
+            self._cvd_m2 += delta * (value - self._cvd_mean)
+        else:
+            # The window is full: replace the oldest value in one step
+            old = history[i]
+            old_mean = self._cvd_mean
+            self._cvd_mean += (value - old) / self._cvd_len
+            self._cvd_m2 += (value - old) * (value - self._cvd_mean + old - old_mean)
+        history[i] = value
+        self._cvd_idx = (i + 1) % len(history)
+
+        if self._cvd_idx == 0:
+            # Once per lap, recompute exactly so rounding in the running update cannot accumulate
+            window = history[:self._cvd_len]
+            self._cvd_mean = float(window.mean())
+            self._cvd_m2 = float(((window - self._cvd_mean) ** 2).sum())
+        self._cvd_m2 = max(self._cvd_m2, 0.0)  # Guard against rounding below zero
+
     def process_candle_data(self, candle):
         """Processes the buffered trades for a completed candle."""
         candle_start_ms = int(candle['start'])
         candle_end_ms = int(candle['end'])
         candle_close_price = float(candle['close'])
 
-        # Convert timestamp
-        dt_object = datetime.datetime.utcfromtimestamp(candle_start_ms / 1000.0)
-        formatted_timestamp = dt_object.strftime('%Y-%m-%d %H:%M:%S,') + f"{dt_object.microsecond // 1000:03d}"
+        # Convert timestamp ('YYYY-mm-dd HH:MM:SS,mmm', UTC)
+        dt_object = datetime.datetime.fromtimestamp(candle_start_ms / 1000.0, tz=datetime.timezone.utc)
+        formatted_timestamp = dt_object.strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
 
         # Step 1: Aggregate Intra-Candle Volumes
-        buy_volume = 0.0
-        sell_volume = 0.0
-        
-        relevant_trades = [
-            t for t in self.trade_buffer 
-            if candle_start_ms <= int(t['T']) <= candle_end_ms
-        ]
-
-        for trade in relevant_trades:
-            volume = float(trade['v'])
-            if trade['S'] == 'Buy':
-                buy_volume += volume
-            elif trade['S'] == 'Sell':
-                sell_volume += volume
+        # Everything up to the (inclusive) candle end is consumed; trades before
+        # the candle start are skipped, then the rest is summed by the compiled kernel.
+        window = self.trade_buffer.drain_window(candle_start_ms, candle_end_ms + 1)
+        buy_volume, sell_volume = _sum_by_side(window['vol'], window['side'], 0, len(window['vol']))
         
         # Step 2: Calculate Per-Minute Volume Delta
         volume_delta = buy_volume - sell_volume
@@ -92,18 +212,15 @@ class OrderFlowTracker:
 
         # Step 4: Update Cumulative Volume Delta (CVD)
         self.cumulative_volume_delta += volume_delta
-        self.cvd_history.append(self.cumulative_volume_delta)
+        self._push_cvd(self.cumulative_volume_delta)
 
         # Step 5: Calculate CVD Z-Score Ratio
         cvd_zscore_ratio = 0.0
-        if len(self.cvd_history) > 1:
-            try:
-                mean_cvd = statistics.mean(self.cvd_history)
-                stdev_cvd = statistics.stdev(self.cvd_history)
-                if stdev_cvd > 0:
-                    cvd_zscore_ratio = (self.cumulative_volume_delta - mean_cvd) / stdev_cvd
-            except statistics.StatisticsError:
-                cvd_zscore_ratio = 0.0
+        n = self._cvd_len
+        if n > 1:
+            stdev_cvd = math.sqrt(self._cvd_m2 / (n - 1))  # Sample standard deviation
+            if stdev_cvd > 0:
+                cvd_zscore_ratio = (self.cumulative_volume_delta - self._cvd_mean) / stdev_cvd
 
 
         # --- MODIFIED: Update the output dictionary format ---
@@ -120,13 +237,25 @@ class OrderFlowTracker:
         }
         logging.info(output)
 
-        # Clean up the buffer
-        self.trade_buffer = [
-            t for t in self.trade_buffer 
-            if int(t['T']) > candle_end_ms
-        ]
+        if pa is not None:
+            # Full precision for replay; only the log line is rounded
+            self._candle_rows.append({
+                "candle_start": candle_start_ms,
+                "close_price": candle_close_price,
+                "buy_volume": buy_volume,
+                "sell_volume": sell_volume,
+                "total_volume": total_volume,
+                "delta": volume_delta,
+                "agg_ratio": agg_ratio,
+                "cumulative_volume_delta": self.cumulative_volume_delta,
+                "cvd_zscore_ratio": cvd_zscore_ratio,
+                "date": formatted_timestamp[:10],
+            })
+            if len(self._candle_rows) >= PARQUET_FLUSH_CANDLES:
+                self.flush_candles()
 
 if __name__ == "__main__":
+    if pa is None: logging.info("pyarrow is not installed; candles are only logged.")
     tracker = OrderFlowTracker(symbol="POPCATUSDT") 
     tracker.run()
 
@@ -2,6 +2,8 @@ import time
 from pybit.unified_trading import WebSocket
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
+import pybit_fast
+from plot_helpers import MessageQueue, figure_hidden
 
 # --- Configuration ---
 SYMBOL = "POPCATUSDT"
@@ -11,68 +13,120 @@ INTERVAL_SECONDS = 3000
 total_buy_volume = 0.0
 total_sell_volume = 0.0
 start_time = 0
+ylim_top = 1.0  # Current y axis ceiling; only raised within an interval
+
+# Raw trade messages, added to the totals on the GUI thread at the start of each frame
+message_queue = MessageQueue()
 
 # --- WebSocket Message Handler ---
+def drain_message_queue():
+    """Adds every queued message to the running totals."""
+    for message in message_queue.drain():
+        handle_trade_message(message)
+
 def handle_trade_message(message):
     global total_buy_volume, total_sell_volume
+    # Summed locally, then written to the globals once per message
+    buy_volume = 0.0
+    sell_volume = 0.0
     trade_events = message.get("data", [])
     for event in trade_events:
         try:
             volume = float(event.get('v'))
             side = event.get('S')
             if side == "Buy":
-                total_buy_volume += volume
+                buy_volume += volume
             elif side == "Sell":
-                total_sell_volume += volume
+                sell_volume += volume
         except (ValueError, TypeError):
             continue
+    total_buy_volume += buy_volume
+    total_sell_volume += sell_volume
+
+# --- Plot Setup ---
+def create_artists(ax):
+    """
+    Creates the bars and labels once. They are animated, so each frame only
+    their data changes and blitting redraws them over a cached background.
+    """
+    labels = ['Aggressive Buyers', 'Aggressive Sellers']
+    colors = ['green', 'red']
+    bars = ax.bar(labels, [0.0, 0.0], color=colors)
+    values = [ax.text(bar.get_x() + bar.get_width()/2.0, 0, '', va='bottom', ha='center') for bar in bars]
+    remaining = ax.text(0.98, 0.97, '', transform=ax.transAxes, va='top', ha='right')
+    for artist in [*bars, *values, remaining]:
+        artist.set_animated(True)
+
+    ax.set_ylabel('Total Volume (POPCAT) Perpetual')
+    ax.set_title(f'Real-Time Buy vs. Sell for {SYMBOL}')
+    ax.set_ylim(0, ylim_top)
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+    return {'bars': bars, 'values': values, 'remaining': remaining}
 
 # --- Animation Update Function ---
-def update_plot(frame, ax):
-    global start_time
+def start_interval(ax):
+    """Resets the totals and the y axis for a new interval, on the same figure and WebSocket."""
+    global total_buy_volume, total_sell_volume, start_time, ylim_top
+    total_buy_volume = 0.0
+    total_sell_volume = 0.0
+    start_time = time.time()
+    message_queue.clear()  # Leftovers belong to the previous interval
+    ylim_top = 1.0
+    ax.set_ylim(0, ylim_top)
+    ax.figure.canvas.draw()
+
+def update_plot(frame, ax, artists):
+    global ylim_top
     elapsed_time = time.time() - start_time
     if elapsed_time > INTERVAL_SECONDS:
-        print("\nInterval complete. Closing plot to restart...")
-        # Closing the plot causes a harmless traceback, which our main loop handles.
-        plt.close() 
-        return
+        print(f"\nInterval complete. Starting new {int(INTERVAL_SECONDS/60)}-minute interval...")
+        start_interval(ax)
+        elapsed_time = 0.0
 
-    labels = ['Aggressive Buyers', 'Aggressive Sellers']
+    drain_message_queue()
+    if figure_hidden(ax.figure):
+        return []  # Totals keep accumulating; drawing resumes once the window is shown
     volumes = [total_buy_volume, total_sell_volume]
-    colors = ['green', 'red']
 
-    ax.clear()
-    bars = ax.bar(labels, volumes, color=colors)
+    for bar, value, yval in zip(artists['bars'], artists['values'], volumes):
+        bar.set_height(yval)
+        value.set_y(yval)
+        value.set_text(f'{yval:,.2f}')
     
-    ax.set_ylabel('Total Volume (POPCAT) Perpetual')
     remaining_time = INTERVAL_SECONDS - elapsed_time
-    ax.set_title(f'Real-Time Buy vs. Sell for {SYMBOL}\nTime Remaining: {remaining_time:.0f}s')
-    ax.set_ylim(0, max(volumes) * 1.2 + 1)
-    ax.grid(axis='y', linestyle='--', alpha=0.7)
-    
-    for bar in bars:
-        yval = bar.get_height()
-        ax.text(bar.get_x() + bar.get_width()/2.0, yval, f'{yval:,.2f}', va='bottom', ha='center')
+    artists['remaining'].set_text(f'Time Remaining: {remaining_time:.0f}s')
+
+    # The y axis is part of the cached background, so it is only re-limited
+    # (and the figure redrawn) once a bar passes 90% of the ceiling; it then
+    # gets 50% headroom and never shrinks until the next interval
+    top = max(volumes)
+    if top > 0.9 * ylim_top:
+        ylim_top = top * 1.5 + 1
+        ax.set_ylim(0, ylim_top)
+        ax.figure.canvas.draw()
+
+    return [*artists['bars'], *artists['values'], artists['remaining']]
 
 # --- Main Script Logic ---
 if __name__ == "__main__":
-    while True:
-        total_buy_volume = 0.0
-        total_sell_volume = 0.0
-        start_time = time.time()
-        
-        print("Connecting to Bybit WebSocket...")
-        ws = WebSocket(testnet=False, channel_type="linear")
-        ws.trade_stream(symbol=SYMBOL, callback=handle_trade_message)
-        print(f"✅ Connection successful. Starting new {int(INTERVAL_SECONDS/60)}-minute plot...")
-        
-        fig, ax = plt.subplots(figsize=(10, 6))
-        
-        # We add save_count=0 to remove the UserWarning
-        ani = animation.FuncAnimation(fig, update_plot, fargs=(ax,), interval=500, save_count=0)
-        
+    pybit_fast.use_fast_json()  # orjson frame decoding, if installed
+    print("Connecting to Bybit WebSocket...")
+    ws = WebSocket(testnet=False, channel_type="linear")
+    ws.trade_stream(symbol=SYMBOL, callback=message_queue.put)
+    print(f"✅ Connection successful. Plotting {int(INTERVAL_SECONDS/60)}-minute intervals...")
+    start_time = time.time()
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    artists = create_artists(ax)
+
+    # We add save_count=0 to remove the UserWarning
+    # blit=True redraws only the animated artists over the cached axes background
+    ani = animation.FuncAnimation(fig, update_plot, fargs=(ax, artists), interval=500, save_count=0, blit=True)
+
+    try:
         plt.show()
-        
+    except KeyboardInterrupt:
+        print("\n🛑 Exiting script.")
+    finally:
         ws.exit()
-        print("WebSocket disconnected. Preparing for the next interval...")
-        time.sleep(3)
\ No newline at end of file
+        print("WebSocket disconnected.")